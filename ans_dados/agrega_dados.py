@@ -1,25 +1,30 @@
 import csv
+import heapq
 import math
-import zipfile
+import sys
+import tempfile
+import zlib
+from array import array
+from itertools import islice
 from pathlib import Path
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
-def parse_float(valor: str):
-    if valor is None:
-        return None
-    v = str(valor).strip()
-    if not v:
-        return None
+from ans_dados.colunar import abrir_leitura
+from ans_dados.numeros import formatar_centavos, parse_centavos
+from ans_dados.saida_zip import abrir_csv_saida
 
-    if "," in v and "." in v and v.rfind(",") > v.rfind("."):
-        v = v.replace(".", "").replace(",", ".")
-    else:
-        v = v.replace(",", ".")
+SUM_COMPENSADO = sys.version_info >= (3, 12)
 
-    try:
-        return float(v)
-    except ValueError:
-        return None
+# Estimativa de memória por registro lido, usada para o limite em MB.
+BYTES_POR_REGISTRO = 200
+# Cada partição aberta para escrita custa os buffers do arquivo e do
+# csv.writer; o número de partições também respeita o limite.
+BYTES_POR_PARTICAO = 160 * 1024
+PARTICOES = 64
 
 
 def trimestre_key(ano: str, trimestre: str) -> str:
@@ -39,19 +44,8 @@ def desvio_padrao_amostral(valores: list[float]) -> float:
     return math.sqrt(var)
 
 
-def agregar_despesas(
-    consolidado_validado_csv: Path,
-    out_dir: Path,
-    zip_path: Path,
-) -> Path:
-    out_dir.mkdir(parents=True, exist_ok=True)
-
-    por_grupo_trimestre: dict[tuple[str, str], dict[str, float]] = {}
-
-    with consolidado_validado_csv.open("r", encoding="utf-8", newline="") as f:
-        reader = csv.DictReader(f)
-        fieldnames = reader.fieldnames or []
-
+def ler_valores(consolidado_validado_csv: Path):
+    with abrir_leitura(consolidado_validado_csv) as (_, reader):
         for row in reader:
             if not (row.get("RazaoSocial") or "").strip():
                 continue
@@ -60,44 +54,272 @@ def agregar_despesas(
 
             razao = (row.get("RazaoSocial") or "").strip()
             uf = (row.get("UF") or "").strip()
-            ano = (row.get("Ano") or "").strip()
+            ano = str(row.get("Ano") or "").strip()
             tri = (row.get("Trimestre") or "").strip()
 
             if not razao or not uf or not ano or not tri:
                 continue
 
-            valor = parse_float(row.get("ValorDespesas"))
+            valor = parse_centavos(row.get("ValorDespesas"))
             if valor is None:
                 continue
 
-            g = (razao, uf)
-            tkey = trimestre_key(ano, tri)
+            yield (razao, uf), trimestre_key(ano, tri), valor
 
-            por_grupo_trimestre.setdefault(g, {})
-            por_grupo_trimestre[g][tkey] = por_grupo_trimestre[g].get(tkey, 0.0) + valor
 
-    linhas = []
-    for (razao, uf), mapa_tri in por_grupo_trimestre.items():
-        valores_trimestrais = [mapa_tri[k] for k in sorted(mapa_tri.keys())]
-        total = sum(valores_trimestrais)
-        med = media(valores_trimestrais)
-        std = desvio_padrao_amostral(valores_trimestrais)
+def linha_grupo(razao: str, uf: str, mapa_tri: dict[str, int]) -> dict:
+    # Valores em centavos: o total é exato, média e desvio ficam em float.
+    valores_trimestrais = [mapa_tri[k] for k in sorted(mapa_tri.keys())]
+    return {
+        "RazaoSocial": razao,
+        "UF": uf,
+        "TotalDespesas": sum(valores_trimestrais),
+        "MediaTrimestral": media(valores_trimestrais),
+        "DesvioPadraoTrimestral": desvio_padrao_amostral(valores_trimestrais),
+        "QtdTrimestres": len(valores_trimestrais),
+    }
+
+
+def agregar_python(valores) -> list[dict]:
+    por_grupo_trimestre: dict[tuple[str, str], dict[str, int]] = {}
+
+    for g, tkey, valor in valores:
+        por_grupo_trimestre.setdefault(g, {})
+        por_grupo_trimestre[g][tkey] = por_grupo_trimestre[g].get(tkey, 0) + valor
+
+    linhas = [linha_grupo(razao, uf, mapa_tri) for (razao, uf), mapa_tri in por_grupo_trimestre.items()]
+    linhas.sort(key=lambda d: d["TotalDespesas"], reverse=True)
+    return linhas
 
+
+def soma_colunas(m, presente):
+    # Soma de cada linha, coluna a coluna, igual ao sum() do Python sobre os
+    # valores presentes (a partir do 3.12 o sum() usa soma compensada).
+    total = np.zeros(m.shape[0], dtype=np.float64)
+    comp = np.zeros(m.shape[0], dtype=np.float64)
+    for j in range(m.shape[1]):
+        x = m[:, j]
+        t = total + x
+        if SUM_COMPENSADO:
+            c = np.where(np.abs(total) >= np.abs(x), (total - t) + x, (x - t) + total)
+            comp = np.where(presente[:, j], comp + c, comp)
+        total = np.where(presente[:, j], t, total)
+    if SUM_COMPENSADO:
+        total = np.where((comp != 0) & np.isfinite(comp), total + comp, total)
+    return total
+
+
+def agregar_numpy(valores) -> list[dict]:
+    # Grupos e trimestres viram códigos inteiros (grupos na ordem em que
+    # aparecem, trimestres em ordem crescente). Somas em centavos int64 são
+    # exatas; média e desvio seguem a mesma ordem de operações do caminho em
+    # Python puro, então o resultado é idêntico.
+    codigos_grupo: dict[tuple[str, str], int] = {}
+    codigos_tri: dict[str, int] = {}
+    g_idx = array("q")
+    t_idx = array("q")
+    vals = array("q")
+
+    for g, tkey, valor in valores:
+        g_idx.append(codigos_grupo.setdefault(g, len(codigos_grupo)))
+        t_idx.append(codigos_tri.setdefault(tkey, len(codigos_tri)))
+        vals.append(valor)
+
+    n_grupos = len(codigos_grupo)
+    if not n_grupos:
+        return []
+
+    tris = sorted(codigos_tri)
+    ordem_tri = np.empty(len(tris), dtype=np.int64)
+    for pos, tkey in enumerate(tris):
+        ordem_tri[codigos_tri[tkey]] = pos
+
+    g = np.frombuffer(g_idx, dtype=np.int64)
+    t = ordem_tri[np.frombuffer(t_idx, dtype=np.int64)]
+
+    somas = np.zeros((n_grupos, len(tris)), dtype=np.int64)
+    np.add.at(somas, (g, t), np.frombuffer(vals, dtype=np.int64))
+    presente = np.zeros((n_grupos, len(tris)), dtype=bool)
+    presente[g, t] = True
+
+    qtd = presente.sum(axis=1)
+    total = somas.sum(axis=1)
+    med = total / qtd
+    # O quadrado usa o ** do Python (pow da libm), que nem sempre coincide
+    # com x * x do NumPy no último bit; são só grupos x trimestres valores.
+    dif = (somas - med[:, None])[presente].tolist()
+    quadrados = np.zeros(somas.shape, dtype=np.float64)
+    quadrados[presente] = [d ** 2 for d in dif]
+    var = soma_colunas(quadrados, presente)
+    std = np.where(qtd > 1, np.sqrt(var / np.maximum(qtd - 1, 1)), 0.0)
+
+    ordem = np.argsort(-total, kind="stable")
+    grupos = list(codigos_grupo)
+
+    linhas = []
+    for i in ordem.tolist():
+        razao, uf = grupos[i]
         linhas.append(
             {
                 "RazaoSocial": razao,
                 "UF": uf,
-                "TotalDespesas": total,
-                "MediaTrimestral": med,
-                "DesvioPadraoTrimestral": std,
-                "QtdTrimestres": len(valores_trimestrais),
+                "TotalDespesas": int(total[i]),
+                "MediaTrimestral": float(med[i]),
+                "DesvioPadraoTrimestral": float(std[i]),
+                "QtdTrimestres": int(qtd[i]),
             }
         )
+    return linhas
 
-    linhas.sort(key=lambda d: d["TotalDespesas"], reverse=True)
+
+def agregar_em_memoria(valores) -> list[dict]:
+    return agregar_numpy(valores) if np is not None else agregar_python(valores)
+
+
+def agregar_particao(path: Path):
+    # Registros de um mesmo grupo ficam na mesma partição e na ordem de
+    # leitura, então as somas saem iguais às do caminho em memória.
+    grupos: dict[tuple[str, str], tuple[int, dict[str, int]]] = {}
+    for razao, uf, tkey, valor, seq in ler_particao(path):
+        _, mapa_tri = grupos.setdefault((razao, uf), (seq, {}))
+        mapa_tri[tkey] = mapa_tri.get(tkey, 0) + valor
+
+    for (razao, uf), (seq, mapa_tri) in grupos.items():
+        yield seq, linha_grupo(razao, uf, mapa_tri)
+
+
+def ler_particao(path: Path):
+    with path.open("r", encoding="utf-8", newline="") as f:
+        for razao, uf, tkey, valor, seq in csv.reader(f):
+            yield razao, uf, tkey, int(valor), int(seq)
+
+
+def particionar(registros, prefixo: Path, nivel: int, quantidade: int) -> list[tuple[Path, int]]:
+    # Espalha os registros por hash do grupo em `quantidade` arquivos e
+    # devolve cada arquivo com a quantidade de registros. O nível entra no
+    # hash para que uma partição dividida de novo não caia inteira no mesmo
+    # arquivo.
+    particoes = [prefixo.with_name(f"{prefixo.name}{i:03d}.csv") for i in range(quantidade)]
+    contagens = [0] * quantidade
+    arquivos = [p.open("w", encoding="utf-8", newline="") for p in particoes]
+    try:
+        writers = [csv.writer(f) for f in arquivos]
+        for razao, uf, tkey, valor, seq in registros:
+            i = zlib.crc32(f"{nivel}\0{razao}\0{uf}".encode("utf-8")) % quantidade
+            writers[i].writerow([razao, uf, tkey, valor, seq])
+            contagens[i] += 1
+    finally:
+        for f in arquivos:
+            f.close()
+    return list(zip(particoes, contagens))
+
+
+def ler_run(path: Path):
+    with path.open("r", encoding="utf-8", newline="") as f:
+        for razao, uf, total, med, std, qtd, seq in csv.reader(f):
+            yield (-int(total), int(seq)), {
+                "RazaoSocial": razao,
+                "UF": uf,
+                "TotalDespesas": int(total),
+                "MediaTrimestral": float(med),
+                "DesvioPadraoTrimestral": float(std),
+                "QtdTrimestres": int(qtd),
+            }
+
+
+def gravar_run(path: Path, linhas) -> None:
+    with path.open("w", encoding="utf-8", newline="") as f:
+        w = csv.writer(f)
+        for seq, d in linhas:
+            w.writerow(
+                [
+                    d["RazaoSocial"],
+                    d["UF"],
+                    d["TotalDespesas"],
+                    repr(d["MediaTrimestral"]),
+                    repr(d["DesvioPadraoTrimestral"]),
+                    d["QtdTrimestres"],
+                    seq,
+                ]
+            )
+
+
+def agregar_em_run(particao: Path, registros: int, max_registros: int, max_particoes: int, nivel: int) -> Path:
+    # Partição dentro do limite: agregada em memória e gravada ordenada
+    # (total decrescente, empate pela primeira ocorrência do grupo).
+    # Acima do limite: dividida de novo por hash, em tantas partes quanto o
+    # tamanho pede, e os runs das subpartições são intercalados num só. Se a
+    # divisão não separa nada (um único grupo), a partição é agregada assim
+    # mesmo: um grupo ocupa só um total por trimestre, qualquer que seja a
+    # quantidade de registros.
+    run = particao.with_name(particao.stem + "_run.csv")
+    if registros > max_registros:
+        quantidade = max(2, min(max_particoes, -(-registros // max_registros)))
+        subparticoes = particionar(
+            ler_particao(particao), particao.with_name(particao.stem + "_"), nivel + 1, quantidade
+        )
+        if all(n < registros for _, n in subparticoes):
+            particao.unlink()
+            runs = [agregar_em_run(sub, n, max_registros, max_particoes, nivel + 1) for sub, n in subparticoes]
+            gravar_run(run, ((k[1], d) for k, d in heapq.merge(*(ler_run(r) for r in runs), key=lambda x: x[0])))
+            for r in runs:
+                r.unlink()
+            return run
+        for sub, _ in subparticoes:
+            sub.unlink()
+
+    linhas = sorted(agregar_particao(particao), key=lambda x: (-x[1]["TotalDespesas"], x[0]))
+    particao.unlink()
+    gravar_run(run, linhas)
+    return run
+
+
+def agregar_limitado(valores, limite_memoria_mb: float, tmp_base: Path):
+    # Até o limite, agrega em memória. Acima dele, os registros vão para
+    # arquivos por hash do grupo (até PARTICOES, conforme o limite); cada
+    # partição é agregada sozinha (ou dividida de novo, se ainda passar do
+    # limite) e os runs ordenados são intercalados com heapq.merge.
+    max_registros = max(1, int(limite_memoria_mb * 1024 * 1024 / BYTES_POR_REGISTRO))
+    max_particoes = max(2, min(PARTICOES, int(limite_memoria_mb * 1024 * 1024 / BYTES_POR_PARTICAO)))
+    it = iter(valores)
+    buffer = list(islice(it, max_registros))
+    if len(buffer) < max_registros:
+        yield from agregar_em_memoria(buffer)
+        return
+
+    def registros():
+        seq = 0
+        for bloco in (buffer, it):
+            for (razao, uf), tkey, valor in bloco:
+                yield razao, uf, tkey, valor, seq
+                seq += 1
+            buffer.clear()
+
+    with tempfile.TemporaryDirectory(dir=tmp_base) as tmp:
+        particoes = particionar(registros(), Path(tmp) / "particao_", 0, max_particoes)
+        runs = [agregar_em_run(particao, n, max_registros, max_particoes, 0) for particao, n in particoes]
+
+        for _, d in heapq.merge(*(ler_run(r) for r in runs), key=lambda x: x[0]):
+            yield d
+
+
+def agregar_despesas(
+    consolidado_validado_csv: Path,
+    out_dir: Path,
+    zip_path: Path,
+    limite_memoria_mb: float | None = None,
+    compressao: str = "padrao",
+) -> Path:
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    valores = ler_valores(consolidado_validado_csv)
+    if limite_memoria_mb is None:
+        linhas = agregar_em_memoria(valores)
+    else:
+        linhas = agregar_limitado(valores, limite_memoria_mb, out_dir)
 
     out_csv = out_dir / "despesas_agregadas.csv"
-    with out_csv.open("w", encoding="utf-8", newline="") as f:
+    with abrir_csv_saida(out_csv, zip_path, compressao) as f:
         w = csv.DictWriter(
             f,
             fieldnames=[
@@ -112,14 +334,11 @@ def agregar_despesas(
         w.writeheader()
         for d in linhas:
             d2 = dict(d)
-            d2["TotalDespesas"] = f"{d2['TotalDespesas']:.2f}"
-            d2["MediaTrimestral"] = f"{d2['MediaTrimestral']:.2f}"
-            d2["DesvioPadraoTrimestral"] = f"{d2['DesvioPadraoTrimestral']:.2f}"
+            d2["TotalDespesas"] = formatar_centavos(d2["TotalDespesas"])
+            d2["MediaTrimestral"] = formatar_centavos(round(d2["MediaTrimestral"]))
+            d2["DesvioPadraoTrimestral"] = formatar_centavos(round(d2["DesvioPadraoTrimestral"]))
             w.writerow(d2)
 
-    with zipfile.ZipFile(zip_path, "w", compression=zipfile.ZIP_DEFLATED) as z:
-        z.write(out_csv, arcname=out_csv.name)
-
     return out_csv
 
 
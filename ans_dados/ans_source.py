@@ -1,12 +1,25 @@
+import json
+import os
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from urllib.parse import urljoin
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from html.parser import HTMLParser
 
 
 BASE_URL = "https://dadosabertos.ans.gov.br/FTP/PDA/demonstracoes_contabeis/"
 
+MANIFESTO = ".manifesto.json"
+TAMANHO_BLOCO = 1024 * 1024
+
+CACHE_LISTAGENS = Path(".documentos/cache/listagens.json")
+TTL_LISTAGENS = 6 * 60 * 60
+
 
 class LinkParser(HTMLParser):
     def __init__(self):
@@ -20,56 +33,260 @@ class LinkParser(HTMLParser):
                     self.links.append(v)
 
 
-def get_links(url: str) -> list[str]:
-    resp = requests.get(url, timeout=30)
+def criar_sessao(conexoes: int = 8) -> requests.Session:
+    sessao = requests.Session()
+    retry = Retry(total=3, backoff_factor=1, status_forcelist=(500, 502, 503, 504))
+    adapter = HTTPAdapter(pool_connections=conexoes, pool_maxsize=conexoes, max_retries=retry)
+    sessao.mount("https://", adapter)
+    sessao.mount("http://", adapter)
+    return sessao
+
+
+def get_links(
+    url: str,
+    sessao: requests.Session | None = None,
+    cache: "CacheListagens | None" = None,
+) -> list[str]:
+    headers = {}
+    if cache is not None:
+        entrada = cache.obter(url)
+        if entrada and cache.fresca(entrada):
+            return entrada["links"]
+        if entrada:
+            if entrada.get("etag"):
+                headers["If-None-Match"] = entrada["etag"]
+            if entrada.get("last_modified"):
+                headers["If-Modified-Since"] = entrada["last_modified"]
+
+    resp = (sessao or requests).get(url, headers=headers, timeout=30)
+    if resp.status_code == 304 and cache is not None:
+        cache.guardar(url, entrada["links"], entrada)
+        return entrada["links"]
+
     resp.raise_for_status()
     parser = LinkParser()
     parser.feed(resp.text)
+
+    if cache is not None:
+        cache.guardar(url, parser.links, validadores(resp))
     return parser.links
 
 
-def get_latest_zip_urls(base_url: str, n: int = 3) -> list[str]:
+def anos_disponiveis(base_url: str, sessao: requests.Session, cache: "CacheListagens | None") -> list[str]:
     years = []
-    for link in get_links(base_url):
+    for link in get_links(base_url, sessao, cache):
         clean = link.split("?")[0].strip("/")
         if re.fullmatch(r"\d{4}", clean):
             years.append(clean + "/")
-    years = sorted(set(years), reverse=True)
+    return sorted(set(years), reverse=True)
+
+
+def zips_do_ano(year_url: str, sessao: requests.Session, cache: "CacheListagens | None") -> list[tuple[int, int, str]]:
+    encontrados = []
+    for link in get_links(year_url, sessao, cache):
+        name = link.split("?")[0]
+        if not name.lower().endswith(".zip"):
+            continue
+
+        m = re.search(r"([1-4])T(20\d{2})", name)
+        if not m:
+            continue
+
+        encontrados.append((int(m.group(2)), int(m.group(1)), urljoin(year_url, name)))
+    return encontrados
+
+
+def get_latest_zip_urls(
+    base_url: str,
+    n: int = 3,
+    jobs: int = 4,
+    cache_path: Path | None = CACHE_LISTAGENS,
+    ttl: float = TTL_LISTAGENS,
+) -> list[str]:
+    cache = CacheListagens(cache_path, ttl) if cache_path else None
 
     grupos: dict[tuple[int, int], list[str]] = {}
 
-    for y in years:
-        year_url = urljoin(base_url, y)
-        for link in get_links(year_url):
-            name = link.split("?")[0]
-            if not name.lower().endswith(".zip"):
-                continue
+    with criar_sessao(jobs) as sessao, ThreadPoolExecutor(max_workers=jobs) as pool:
+        years = anos_disponiveis(base_url, sessao, cache)
 
-            m = re.search(r"([1-4])T(20\d{2})", name)
-            if not m:
-                continue
+        # Anos do mais novo para o mais antigo, em lotes paralelos. Para assim que
+        # os n trimestres mais recentes não puderem mais receber arquivos de anos
+        # anteriores.
+        for i in range(0, len(years), jobs):
+            lote = years[i:i + jobs]
+            for encontrados in pool.map(lambda y: zips_do_ano(urljoin(base_url, y), sessao, cache), lote):
+                for ano, tri, url in encontrados:
+                    grupos.setdefault((ano, tri), []).append(url)
+
+            restantes = years[i + jobs:]
+            ultimos = sorted(grupos.keys(), reverse=True)[:n]
+            if not restantes or (len(ultimos) == n and ultimos[-1][0] > int(restantes[0].strip("/"))):
+                break
 
-            tri = int(m.group(1))
-            ano = int(m.group(2))
-            grupos.setdefault((ano, tri), []).append(urljoin(year_url, name))
+    if cache is not None:
+        cache.salvar()
 
     ultimos = sorted(grupos.keys(), reverse=True)[:n]
 
     urls = []
     for t in ultimos:
-        urls.extend(sorted(grupos[t]))
+        urls.extend(sorted(set(grupos[t])))
     return urls
 
 
-def download_zips(urls: list[str], out_dir: Path) -> None:
-    out_dir.mkdir(parents=True, exist_ok=True)
+class CacheListagens:
+    def __init__(self, path: Path, ttl: float):
+        self.path = path
+        self.ttl = ttl
+        self.dados = ler_json(path)
+        self.lock = threading.Lock()
+
+    def obter(self, url: str) -> dict | None:
+        with self.lock:
+            return self.dados.get(url)
+
+    def fresca(self, entrada: dict) -> bool:
+        return time.time() - entrada.get("obtido_em", 0) < self.ttl
+
+    def guardar(self, url: str, links: list[str], meta: dict) -> None:
+        with self.lock:
+            self.dados[url] = {
+                "links": links,
+                "etag": meta.get("etag"),
+                "last_modified": meta.get("last_modified"),
+                "obtido_em": time.time(),
+            }
+
+    def salvar(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.lock:
+            gravar_json(self.path, self.dados)
 
-    for url in urls:
-        filename = url.split("/")[-1]
-        path = out_dir / filename
-        if path.exists():
-            continue
 
-        r = requests.get(url, timeout=120)
+def ler_json(path: Path) -> dict:
+    if not path.exists():
+        return {}
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+
+def gravar_json(path: Path, dados: dict) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps(dados, indent=2, sort_keys=True), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def validadores(resp: requests.Response) -> dict:
+    return {
+        "etag": resp.headers.get("ETag"),
+        "last_modified": resp.headers.get("Last-Modified"),
+    }
+
+
+def baixar_zip(sessao: requests.Session, url: str, path: Path, meta: dict | None) -> dict:
+    parcial = path.with_name(path.name + ".part")
+    meta_parcial = path.with_name(path.name + ".part.json")
+
+    # ZIP não ganha nada com compressão HTTP, e sem ela os tamanhos de
+    # Content-Length e Content-Range são os dos bytes gravados.
+    headers = {"Accept-Encoding": "identity"}
+    if meta and path.exists() and path.stat().st_size == meta.get("tamanho"):
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    inicio = 0
+    if "If-None-Match" not in headers and "If-Modified-Since" not in headers and parcial.exists():
+        anterior = ler_json(meta_parcial)
+        if_range = anterior.get("etag") or anterior.get("last_modified")
+        if if_range:
+            inicio = parcial.stat().st_size
+            headers["Range"] = f"bytes={inicio}-"
+            headers["If-Range"] = if_range
+
+    with sessao.get(url, headers=headers, stream=True, timeout=120) as r:
+        if r.status_code == 304:
+            return meta
+
+        if r.status_code == 416:
+            parcial.unlink(missing_ok=True)
+            meta_parcial.unlink(missing_ok=True)
+            return baixar_zip(sessao, url, path, None)
+
         r.raise_for_status()
-        path.write_bytes(r.content)
+
+        novo = validadores(r)
+        codificado = r.headers.get("Content-Encoding", "identity").strip().lower() not in ("", "identity")
+        if r.status_code == 206:
+            faixa = re.fullmatch(r"bytes (\d+)-(\d+)/(\d+|\*)", r.headers.get("Content-Range", "").strip())
+            if codificado or not faixa or int(faixa.group(1)) != inicio:
+                # O trecho não continua o .part: recomeça do zero em vez de
+                # emendar bytes de outro lugar do arquivo.
+                parcial.unlink(missing_ok=True)
+                meta_parcial.unlink(missing_ok=True)
+                return baixar_zip(sessao, url, path, None)
+            modo = "ab"
+            esperado = int(faixa.group(2)) - inicio + 1
+            total = int(faixa.group(3)) if faixa.group(3) != "*" else 0
+        else:
+            modo = "wb"
+            inicio = 0
+            esperado = int(r.headers.get("Content-Length") or 0)
+            # Com Content-Encoding o Content-Length é do corpo codificado, e
+            # um Range valeria para ele, não para o .part decodificado.
+            total = 0 if codificado else esperado
+            if codificado:
+                meta_parcial.unlink(missing_ok=True)
+            else:
+                gravar_json(meta_parcial, novo)
+
+        with parcial.open(modo) as f:
+            for bloco in r.iter_content(TAMANHO_BLOCO):
+                f.write(bloco)
+        # Bytes recebidos da rede, antes de qualquer decodificação.
+        recebidos = r.raw.tell()
+
+    if esperado and recebidos != esperado:
+        raise IOError(f"Download incompleto de {url}: {recebidos} de {esperado} bytes")
+    tamanho = parcial.stat().st_size
+    if total and tamanho != total:
+        raise IOError(f"Download incompleto de {url}: {tamanho} de {total} bytes")
+
+    os.replace(parcial, path)
+    meta_parcial.unlink(missing_ok=True)
+
+    return {"url": url, "tamanho": tamanho, **novo}
+
+
+def download_zips(urls: list[str], out_dir: Path, jobs: int = 4) -> None:
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    manifesto_path = out_dir / MANIFESTO
+    manifesto = ler_json(manifesto_path)
+
+    with criar_sessao(jobs) as sessao, ThreadPoolExecutor(max_workers=jobs) as pool:
+        futuros = {}
+        for url in urls:
+            filename = url.split("/")[-1]
+            meta = manifesto.get(filename)
+            if meta and meta.get("url") != url:
+                meta = None
+            fut = pool.submit(baixar_zip, sessao, url, out_dir / filename, meta)
+            futuros[fut] = filename
+
+        erros = []
+        for fut in as_completed(futuros):
+            filename = futuros[fut]
+            try:
+                manifesto[filename] = fut.result()
+            except Exception as e:
+                erros.append(f"{filename}: {e}")
+                continue
+            gravar_json(manifesto_path, manifesto)
+
+    if erros:
+        raise RuntimeError("Falha no download: " + "; ".join(erros))
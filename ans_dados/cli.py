@@ -1,10 +1,43 @@
+import argparse
+import json
 from pathlib import Path
 from ans_dados.ans_source import get_latest_zip_urls, download_zips, BASE_URL
-from ans_dados.processa_dados import extrair_zips, contar_arquivos_com_eventos
-from ans_dados.consolida_dados import gerar_finalizado, zipar_finalizado
+from ans_dados.processa_dados import extrair_zips, novas_estatisticas
+from ans_dados.consolida_dados import gerar_finalizado
+from ans_dados.saida_zip import COMPRESSOES
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Download e consolidação das demonstrações contábeis da ANS")
+    parser.add_argument(
+        "--extrair",
+        action="store_true",
+        help="extrai os zips em .documentos/extracao antes de ler (padrão: lê direto dos zips)",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="quantidade de processos para ler os arquivos em paralelo (padrão: 1)",
+    )
+    parser.add_argument(
+        "--pre-filtro",
+        action="store_true",
+        help="descarta em bytes as linhas sem evento/sinistro antes do parser CSV",
+    )
+    parser.add_argument(
+        "--compressao",
+        choices=list(COMPRESSOES),
+        default="padrao",
+        help="compressão do consolidado_despesas.zip (padrão: deflate nível padrão)",
+    )
+    parser.add_argument(
+        "--completo",
+        action="store_true",
+        help="ignora o estado salvo e relê todos os arquivos",
+    )
+    args = parser.parse_args()
+
     zips_dir = Path(".documentos/zips")
     extracao_dir = Path(".documentos/extracao")
     cons_dir = Path(".documentos/filtrado")
@@ -14,14 +47,36 @@ def main():
     download_zips(urls, zips_dir)
 
     # 1.2
-    extrair_zips(zips_dir, extracao_dir)
-    total = contar_arquivos_com_eventos(extracao_dir)
-
-    # 1.3
-    finalizado = gerar_finalizado(extracao_dir, cons_dir)
-    zipar_finalizado(finalizado, Path("consolidado_despesas.zip"))
-    
-    print(f"Processamento finalizado. Arquivos válidos: {total}")
+    if args.extrair:
+        extrair_zips(zips_dir, extracao_dir)
+        leitura_dir = extracao_dir
+    else:
+        leitura_dir = zips_dir
+
+    # 1.2 + 1.3 em uma única leitura dos arquivos
+    estatisticas = novas_estatisticas()
+    finalizado = gerar_finalizado(
+        leitura_dir,
+        cons_dir,
+        estatisticas,
+        jobs=args.jobs,
+        pre_filtro=args.pre_filtro,
+        incremental=not args.completo,
+        zip_path=Path("consolidado_despesas.zip"),
+        compressao=args.compressao,
+    )
+
+    (cons_dir / "estatisticas.json").write_text(json.dumps(estatisticas, indent=2), encoding="utf-8")
+
+    print(f"Processamento finalizado. Arquivos válidos: {estatisticas['arquivos_com_eventos']}")
+    print(
+        f"Arquivos lidos: {estatisticas['arquivos_lidos']} "
+        f"(reprocessados: {estatisticas['arquivos_reprocessados']}) | "
+        f"Linhas com eventos: {estatisticas['linhas_com_eventos']} | "
+        f"Falhas de leitura: {estatisticas['falhas_leitura']}"
+    )
+    for tipo, qtd in sorted(estatisticas["inconsistencias_por_tipo"].items()):
+        print(f"Inconsistências {tipo}: {qtd}")
     print(f"Arquivo gerado: consolidado_despesas.zip")
 
 if __name__ == "__main__":
@@ -0,0 +1,285 @@
+import csv
+import json
+import math
+import mmap
+import os
+import struct
+from array import array
+from contextlib import contextmanager
+from pathlib import Path
+
+from ans_dados.numeros import Centavos, formatar_centavos, parse_centavos
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# Formato colunar para os arquivos intermediários entre etapas:
+#
+#   b"ANSCOL01" | uint64 tamanho do cabeçalho | cabeçalho JSON | blocos
+#
+# Cada bloco começa alinhado em 8 bytes. Colunas "f8" e "i8" são vetores
+# little-endian de float64/int64; colunas "centavos" são int64 com o valor em
+# centavos (VAZIO_CENTAVOS = sem valor), lidas como numeros.Centavos e só
+# formatadas em texto(); colunas "str" guardam códigos int32 e um
+# dicionário (offsets int64 + bytes utf-8). Tudo pode ser lido direto do mmap
+# com numpy.frombuffer ou memoryview.cast, sem cópia.
+
+MAGICO = b"ANSCOL01"
+SUFIXO = ".colunar"
+ALINHAMENTO = 8
+
+TIPOS_ARRAY = {"f8": "d", "i8": "q", "centavos": "q", "codigos": "i", "offsets": "q"}
+TIPOS_NUMPY = {"f8": "<f8", "i8": "<i8", "centavos": "<i8", "codigos": "<i4", "offsets": "<i8"}
+VAZIO_CENTAVOS = -(2**63)
+
+# Colunas numéricas das tabelas de despesas; as demais são texto.
+ESQUEMA_DESPESAS = {"Ano": "i8", "ValorDespesas": "centavos"}
+
+
+def eh_colunar(path: Path) -> bool:
+    return path.suffix == SUFIXO
+
+
+def para_f8(v) -> float:
+    if isinstance(v, (int, float)):
+        return float(v)
+    try:
+        return float(str(v).strip())
+    except ValueError:
+        return math.nan
+
+
+def para_i8(v) -> int:
+    if isinstance(v, int):
+        return v
+    try:
+        return int(str(v).strip())
+    except ValueError:
+        return 0
+
+
+def para_centavos(v) -> int:
+    c = parse_centavos(v)
+    return VAZIO_CENTAVOS if c is None else c
+
+
+def de_centavos(c: int) -> Centavos | None:
+    return None if c == VAZIO_CENTAVOS else Centavos(c)
+
+
+def texto(v) -> str:
+    if v is None:
+        return ""
+    if isinstance(v, Centavos):
+        return formatar_centavos(v)
+    if isinstance(v, float):
+        return "" if math.isnan(v) else f"{v:.2f}"
+    return str(v)
+
+
+class EscritorColunar:
+    # meta: dicionário livre gravado no cabeçalho (ex.: hash dos arquivos de origem).
+    def __init__(self, path: Path, esquema: dict[str, str], meta: dict | None = None):
+        self.path = path
+        self.esquema = esquema
+        self.meta = meta or {}
+        self.dados = {}
+        self.dicionarios = {}
+        for nome, tipo in esquema.items():
+            if tipo == "str":
+                self.dados[nome] = array("i")
+                self.dicionarios[nome] = {}
+            else:
+                self.dados[nome] = array(TIPOS_ARRAY[tipo])
+        self.n = 0
+
+    def writerow(self, row: dict) -> None:
+        for nome, tipo in self.esquema.items():
+            v = row.get(nome)
+            if tipo == "f8":
+                self.dados[nome].append(para_f8(v))
+            elif tipo == "i8":
+                self.dados[nome].append(para_i8(v))
+            elif tipo == "centavos":
+                self.dados[nome].append(para_centavos(v))
+            else:
+                dic = self.dicionarios[nome]
+                s = texto(v)
+                self.dados[nome].append(dic.setdefault(s, len(dic)))
+        self.n += 1
+
+    def writerows(self, rows) -> None:
+        for row in rows:
+            self.writerow(row)
+
+    def fechar(self) -> None:
+        blocos = []
+        colunas = []
+        pos = 0
+
+        def bloco(dados: bytes) -> tuple[int, int]:
+            nonlocal pos
+            inicio = pos
+            blocos.append(dados)
+            pos += len(dados)
+            pad = -pos % ALINHAMENTO
+            if pad:
+                blocos.append(b"\0" * pad)
+                pos += pad
+            return inicio, len(dados)
+
+        for nome, tipo in self.esquema.items():
+            col = {"nome": nome, "tipo": tipo}
+            col["dados"] = bloco(self.dados[nome].tobytes())
+            if tipo == "str":
+                textos = [s.encode("utf-8") for s in self.dicionarios[nome]]
+                offsets = array("q", [0])
+                for t in textos:
+                    offsets.append(offsets[-1] + len(t))
+                col["offsets"] = bloco(offsets.tobytes())
+                col["textos"] = bloco(b"".join(textos))
+            colunas.append(col)
+
+        cabecalho = json.dumps({"linhas": self.n, "colunas": colunas, "meta": self.meta}).encode("utf-8")
+        cabecalho += b" " * (-(len(MAGICO) + 8 + len(cabecalho)) % ALINHAMENTO)
+
+        tmp = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        with tmp.open("wb") as f:
+            f.write(MAGICO)
+            f.write(struct.pack("<Q", len(cabecalho)))
+            f.write(cabecalho)
+            for b in blocos:
+                f.write(b)
+        os.replace(tmp, self.path)
+
+
+class TabelaColunar:
+    def __init__(self, path: Path):
+        self.path = path
+        self._arquivo = path.open("rb")
+        self.mm = mmap.mmap(self._arquivo.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self.mm[:len(MAGICO)] != MAGICO:
+            self.close()
+            raise ValueError(f"Arquivo colunar inválido: {path}")
+
+        (tam,) = struct.unpack_from("<Q", self.mm, len(MAGICO))
+        inicio = len(MAGICO) + 8
+        cab = json.loads(bytes(self.mm[inicio:inicio + tam]))
+        self.base = inicio + tam
+        self.n = cab["linhas"]
+        self.colunas = {c["nome"]: c for c in cab["colunas"]}
+        self.nomes = list(self.colunas)
+        self.meta = cab.get("meta", {})
+        self.vetores = {}
+
+    def close(self) -> None:
+        self.vetores.clear()
+        self.mm.close()
+        self._arquivo.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def vetor(self, bloco: list[int], tipo: str):
+        inicio, tamanho = bloco
+        if np is not None:
+            dtype = np.dtype(TIPOS_NUMPY[tipo])
+            return np.frombuffer(self.mm, dtype=dtype, count=tamanho // dtype.itemsize, offset=self.base + inicio)
+        return memoryview(self.mm)[self.base + inicio:self.base + inicio + tamanho].cast(TIPOS_ARRAY[tipo])
+
+    def coluna(self, nome: str):
+        col = self.colunas[nome]
+        if col["tipo"] == "str":
+            return self.vetor(col["dados"], "codigos")
+        return self.vetor(col["dados"], col["tipo"])
+
+    def elementos(self, nome: str, parte: str, tipo: str) -> memoryview:
+        # memoryview (e não numpy) para acesso a um elemento por vez: devolve
+        # int/float do Python direto, sem criar escalares numpy.
+        chave = (nome, parte)
+        if chave not in self.vetores:
+            inicio, tamanho = self.colunas[nome][parte]
+            inicio += self.base
+            self.vetores[chave] = memoryview(self.mm)[inicio:inicio + tamanho].cast(TIPOS_ARRAY[tipo])
+        return self.vetores[chave]
+
+    def valor(self, nome: str, i: int):
+        # Uma célula, sem montar a coluna nem o dicionário inteiros.
+        col = self.colunas[nome]
+        if col["tipo"] == "centavos":
+            return de_centavos(self.elementos(nome, "dados", "centavos")[i])
+        if col["tipo"] != "str":
+            return self.elementos(nome, "dados", col["tipo"])[i]
+
+        codigo = self.elementos(nome, "dados", "codigos")[i]
+        offsets = self.elementos(nome, "offsets", "offsets")
+        inicio = self.base + col["textos"][0]
+        return self.mm[inicio + offsets[codigo]:inicio + offsets[codigo + 1]].decode("utf-8")
+
+    def dicionario(self, nome: str) -> list[str]:
+        col = self.colunas[nome]
+        offsets = self.vetor(col["offsets"], "offsets").tolist()
+        inicio, tamanho = col["textos"]
+        dados = self.mm[self.base + inicio:self.base + inicio + tamanho]
+        return [dados[a:b].decode("utf-8") for a, b in zip(offsets, offsets[1:])]
+
+    def valores(self, nome: str) -> list:
+        tipo = self.colunas[nome]["tipo"]
+        if tipo == "str":
+            dic = self.dicionario(nome)
+            return [dic[c] for c in self.coluna(nome).tolist()]
+        if tipo == "centavos":
+            return [de_centavos(c) for c in self.coluna(nome).tolist()]
+        return self.coluna(nome).tolist()
+
+    def linhas(self):
+        colunas = [self.valores(nome) for nome in self.nomes]
+        for valores in zip(*colunas):
+            yield dict(zip(self.nomes, valores))
+
+
+@contextmanager
+def abrir_leitura(path: Path):
+    # Devolve (nomes das colunas, iterador de dicts) para CSV ou colunar.
+    if eh_colunar(path):
+        with TabelaColunar(path) as t:
+            yield t.nomes, t.linhas()
+        return
+
+    with path.open("r", encoding="utf-8", newline="") as f:
+        reader = csv.DictReader(f)
+        yield reader.fieldnames or [], reader
+
+
+class EscritorCsv:
+    def __init__(self, f, campos: list[str]):
+        self.w = csv.DictWriter(f, fieldnames=campos)
+        self.w.writeheader()
+
+    def writerow(self, row: dict) -> None:
+        self.w.writerow({k: v if isinstance(v, str) else texto(v) for k, v in row.items()})
+
+    def writerows(self, rows) -> None:
+        for row in rows:
+            self.writerow(row)
+
+
+@contextmanager
+def abrir_escrita(path: Path, campos: list[str], esquema: dict[str, str] | None = None):
+    # Colunas fora do esquema são gravadas como texto.
+    if eh_colunar(path):
+        esquema = {c: (esquema or {}).get(c, "str") for c in campos}
+        w = EscritorColunar(path, esquema)
+        yield w
+        w.fechar()
+        return
+
+    with path.open("w", encoding="utf-8", newline="") as f:
+        yield EscritorCsv(f, campos)
@@ -1,9 +1,38 @@
 import csv
+import hashlib
+import json
+import multiprocessing
+import os
 import re
 import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
 
-from ans_dados.processa_dados import filtrar_eventos_sinistros
+from ans_dados import processa_dados
+from ans_dados.colunar import ESQUEMA_DESPESAS, SUFIXO, abrir_escrita
+from ans_dados.numeros import Centavos, formatar_centavos
+from ans_dados.saida_zip import abrir_csv_saida, abrir_zip
+from ans_dados.processa_dados import (
+    BLOCO_LEITURA,
+    dividir_fonte,
+    filtrar_fonte,
+    listar_fontes,
+    nome_fonte,
+    novas_estatisticas,
+)
+
+CAMPOS_CONSOLIDADO = ["RegistroANS", "RazaoSocial", "Trimestre", "Ano", "ValorDespesas"]
+
+ESTADO_CONSOLIDACAO = "estado_consolidacao.json"
+VERSAO_ESTADO = 4
+# Inconsistências de cada tarefa, uma por arquivo; o estado guarda só o nome.
+PASTA_INCONSISTENCIAS = "inconsistencias_parciais"
+
+# Colunas fixas de inconsistencias.csv; cada inconsistência é guardada como
+# lista nessa ordem, com "" nos campos que não se aplicam ao tipo.
+CAMPOS_INCONSISTENCIAS = ["Ano", "Arquivo", "RegistroANS", "Tipo", "Trimestre", "Valor"]
+POS_TIPO = CAMPOS_INCONSISTENCIAS.index("Tipo")
 
 
 def ano_trimestre(path: Path) -> tuple[int | None, str | None]:
@@ -13,67 +42,299 @@ def ano_trimestre(path: Path) -> tuple[int | None, str | None]:
     return int(m.group(2)), f"{m.group(1)}T"
 
 
-def gerar_finalizado(extracao_dir: Path, cons_dir: Path) -> Path:
-    cons_dir.mkdir(parents=True, exist_ok=True)
+def inconsistencia(tipo: str, arquivo: str, reg_ans: str = "", ano="", tri: str = "", valor: str = "") -> list[str]:
+    return [str(ano), arquivo, reg_ans, tipo, tri, valor]
 
-    soma: dict[tuple[str, int, str], float] = {}
-    inconsist = []
 
-    for item in filtrar_eventos_sinistros(extracao_dir):
-        arq = Path(item["arquivo"])
-        ano, tri = ano_trimestre(arq)
-        if ano is None or tri is None:
-            inconsist.append({"Tipo": "TRIMESTRE_INVALIDO", "Arquivo": str(arq)})
-            continue
+def digest_inconsistencia(linha: list[str]) -> bytes:
+    return hashlib.blake2b("\x1f".join(linha).encode("utf-8"), digest_size=16).digest()
+
+
+def arquivo_inconsistencias(nome: str, impressao: str, trecho) -> str:
+    chave = f"{nome}\0{impressao}\0{trecho}".encode("utf-8")
+    return hashlib.blake2b(chave, digest_size=16).hexdigest() + ".csv"
+
+
+def consolidar_tarefa(tarefa, pre_filtro: bool = False) -> dict:
+    # As inconsistências vão para `destino` à medida que aparecem; na memória
+    # fica só o digest de cada uma, para descartar as repetidas.
+    fonte, trecho, destino = tarefa
+
+    soma: dict[tuple[str, int, str], int] = {}
+    vistos: set[bytes] = set()
+    linhas = 0
+    falha = False
+
+    tmp = destino.with_name(destino.name + ".tmp")
+    f = tmp.open("w", encoding="utf-8", newline="")
+    w = csv.writer(f)
+
+    def anotar(linha: list[str]) -> None:
+        d = digest_inconsistencia(linha)
+        if d not in vistos:
+            vistos.add(d)
+            w.writerow(linha)
+
+    try:
+        for item in filtrar_fonte(fonte, trecho, pre_filtro):
+            linhas += 1
+            arq = Path(item["arquivo"])
+            ano, tri = ano_trimestre(arq)
+            if ano is None or tri is None:
+                anotar(inconsistencia("TRIMESTRE_INVALIDO", str(arq)))
+                continue
+
+            valor = item["valor"]
+            reg_ans = str(item.get("id_operadora") or "").strip()
 
-        valor = float(item["valor"])
-        reg_ans = str(item.get("id_operadora") or "").strip()
+            if not reg_ans:
+                anotar(inconsistencia("REG_ANS_VAZIO", str(arq)))
+                continue
 
-        if not reg_ans:
-            inconsist.append({"Tipo": "REG_ANS_VAZIO", "Arquivo": str(arq)})
+            chave = (reg_ans, ano, tri)
+            soma[chave] = soma.get(chave, 0) + valor
+
+            if valor <= 0:
+                anotar(inconsistencia("VALOR_ZERO_OU_NEGATIVO", str(arq), reg_ans, ano, tri, formatar_centavos(valor)))
+    except Exception as e:
+        # Arquivo com erro fica de fora por inteiro: nada do que já foi lido
+        # dele entra na soma nem nas inconsistências.
+        print(f"Falha ao ler {nome_fonte(fonte)}: {e!r}")
+        soma = {}
+        vistos.clear()
+        linhas = 0
+        falha = True
+    finally:
+        f.close()
+
+    # Sem inconsistências (ou com falha) não fica arquivo nenhum.
+    if vistos:
+        os.replace(tmp, destino)
+    else:
+        tmp.unlink()
+
+    return {
+        "arquivo": nome_fonte(fonte),
+        "soma": soma,
+        "inconsistencias": destino.name if vistos else None,
+        "linhas": linhas,
+        "falha": falha,
+    }
+
+
+def consolidar_parciais(tarefas: list, jobs: int = 1, pre_filtro: bool = False):
+    tarefa = partial(consolidar_tarefa, pre_filtro=pre_filtro)
+    if jobs <= 1:
+        yield from map(tarefa, tarefas)
+        return
+
+    # spawn: o pipeline roda etapas em threads, e fork com threads ativas
+    # pode herdar locks presos.
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context("spawn")) as pool:
+        yield from pool.map(tarefa, tarefas)
+
+
+def impressoes_fontes(fontes: list, anterior: dict) -> dict[str, dict]:
+    # Membros de zip usam o CRC32 e o tamanho do diretório central; arquivos
+    # soltos usam sha256, recalculado só quando tamanho ou mtime mudam.
+    impressoes = {}
+    crcs: dict[Path, dict[str, zipfile.ZipInfo]] = {}
+
+    for fonte in fontes:
+        nome = nome_fonte(fonte)
+        if isinstance(fonte, tuple):
+            zip_path, membro = fonte
+            if zip_path not in crcs:
+                with zipfile.ZipFile(zip_path, "r") as z:
+                    crcs[zip_path] = {i.filename: i for i in z.infolist()}
+            info = crcs[zip_path][membro]
+            impressoes[nome] = {"impressao": f"crc32:{info.CRC:08x}:{info.file_size}"}
             continue
 
-        chave = (reg_ans, ano, tri)
-        soma[chave] = soma.get(chave, 0.0) + valor
-
-        if valor <= 0:
-            inconsist.append(
-                {
-                    "Tipo": "VALOR_ZERO_OU_NEGATIVO",
-                    "RegistroANS": reg_ans,
-                    "Ano": ano,
-                    "Trimestre": tri,
-                    "Valor": valor,
-                    "Arquivo": str(arq),
-                }
-            )
+        st = fonte.stat()
+        antes = anterior.get(nome) or {}
+        if antes.get("tamanho") == st.st_size and antes.get("mtime_ns") == st.st_mtime_ns:
+            impressao = antes["impressao"]
+        else:
+            h = hashlib.sha256()
+            with fonte.open("rb") as f:
+                while bloco := f.read(BLOCO_LEITURA):
+                    h.update(bloco)
+            impressao = f"sha256:{h.hexdigest()}"
+        impressoes[nome] = {"impressao": impressao, "tamanho": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+    return impressoes
+
+
+def parcial_para_json(parcial: dict) -> dict:
+    return {
+        **parcial,
+        "soma": [[reg_ans, ano, tri, valor] for (reg_ans, ano, tri), valor in parcial["soma"].items()],
+    }
+
+
+def parcial_de_json(dados: dict) -> dict:
+    return {
+        **dados,
+        "soma": {(reg_ans, ano, tri): valor for reg_ans, ano, tri, valor in dados["soma"]},
+    }
 
+
+def carregar_estado(path: Path) -> dict:
+    if not path.exists():
+        return {}
+    try:
+        estado = json.loads(path.read_text(encoding="utf-8"))
+    except ValueError:
+        return {}
+    if estado.get("versao") != VERSAO_ESTADO or estado.get("tamanho_pedaco") != processa_dados.TAMANHO_PEDACO:
+        return {}
+    return estado.get("fontes", {})
+
+
+def salvar_estado(path: Path, fontes: dict) -> None:
+    estado = {"versao": VERSAO_ESTADO, "tamanho_pedaco": processa_dados.TAMANHO_PEDACO, "fontes": fontes}
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps(estado), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def gerar_finalizado(
+    extracao_dir: Path,
+    cons_dir: Path,
+    estatisticas: dict | None = None,
+    jobs: int = 1,
+    pre_filtro: bool = False,
+    incremental: bool = True,
+    colunar: bool = False,
+    zip_path: Path | None = None,
+    compressao: str = "padrao",
+) -> Path:
+    cons_dir.mkdir(parents=True, exist_ok=True)
+
+    if estatisticas is None:
+        estatisticas = novas_estatisticas()
+
+    # Estado salvo com a impressão digital de cada arquivo e as somas
+    # parciais que ele gerou: só arquivos novos ou alterados são lidos de novo,
+    # e arquivos removidos simplesmente deixam de entrar na soma.
+    estado_path = cons_dir / ESTADO_CONSOLIDACAO
+    anterior = carregar_estado(estado_path) if incremental else {}
+
+    fontes = sorted(listar_fontes(extracao_dir), key=nome_fonte)
+    impressoes = impressoes_fontes(fontes, anterior)
+
+    pasta = cons_dir / PASTA_INCONSISTENCIAS
+    pasta.mkdir(exist_ok=True)
+
+    def em_dia(nome: str) -> bool:
+        antes = anterior.get(nome) or {}
+        if antes.get("impressao") != impressoes[nome]["impressao"]:
+            return False
+        return all((pasta / p["inconsistencias"]).exists() for p in antes["parciais"] if p["inconsistencias"])
+
+    pendentes = [fonte for fonte in fontes if not em_dia(nome_fonte(fonte))]
+    tarefas = []
+    for fonte in pendentes:
+        nome = nome_fonte(fonte)
+        # Dividir em pedaços só compensa com mais de um processo.
+        for trecho in dividir_fonte(fonte) if jobs > 1 else [None]:
+            tarefas.append((fonte, trecho, pasta / arquivo_inconsistencias(nome, impressoes[nome]["impressao"], trecho)))
+
+    novos: dict[str, list[dict]] = {}
+    for parcial in consolidar_parciais(tarefas, jobs, pre_filtro):
+        novos.setdefault(parcial["arquivo"], []).append(parcial)
+
+    estatisticas["arquivos_reprocessados"] += len(pendentes)
+
+    # Somas em centavos inteiros: exatas, independentes da ordem de junção.
+    soma: dict[tuple[str, int, str], int] = {}
+
+    # Cada tarefa devolve somas parciais de um arquivo (ou de um pedaço dele).
+    # A junção segue sempre a ordem dos arquivos, então o resultado é o mesmo
+    # com qualquer quantidade de processos e com ou sem estado salvo.
+    # As inconsistências de cada parcial são lidas do arquivo dela e vão
+    # direto para o CSV; para descartar repetidas basta guardar um digest de
+    # 16 bytes por linha já gravada.
+    por_tipo = estatisticas.setdefault("inconsistencias_por_tipo", {})
+    vistos: set[bytes] = set()
+    inc = cons_dir / "inconsistencias.csv"
+    inc_tmp = inc.with_name(inc.name + ".tmp")
+    estado = {}
+    with inc_tmp.open("w", encoding="utf-8", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(CAMPOS_INCONSISTENCIAS)
+
+        for fonte in fontes:
+            nome = nome_fonte(fonte)
+            if nome in novos:
+                parciais = novos.pop(nome)
+            else:
+                parciais = [parcial_de_json(p) for p in anterior[nome]["parciais"]]
+
+            # Basta um pedaço com falha para descartar o arquivo inteiro. Ele
+            # também fica fora do estado, para ser lido de novo na próxima vez.
+            falha = any(parcial["falha"] for parcial in parciais)
+            if falha:
+                parciais = []
+            else:
+                estado[nome] = {**impressoes[nome], "parciais": [parcial_para_json(p) for p in parciais]}
+
+            linhas = 0
+            for parcial in parciais:
+                for chave, valor in parcial["soma"].items():
+                    soma[chave] = soma.get(chave, 0) + valor
+                if parcial["inconsistencias"]:
+                    with (pasta / parcial["inconsistencias"]).open("r", encoding="utf-8", newline="") as fp:
+                        for linha in csv.reader(fp):
+                            d = digest_inconsistencia(linha)
+                            if d not in vistos:
+                                vistos.add(d)
+                                w.writerow(linha)
+                                por_tipo[linha[POS_TIPO]] = por_tipo.get(linha[POS_TIPO], 0) + 1
+                linhas += parcial["linhas"]
+
+            estatisticas["arquivos_lidos"] += 1
+            estatisticas["arquivos_com_eventos"] += 1 if linhas else 0
+            estatisticas["linhas_com_eventos"] += linhas
+            estatisticas["falhas_leitura"] += 1 if falha else 0
+    os.replace(inc_tmp, inc)
+
+    salvar_estado(estado_path, estado)
+
+    # Só depois de salvo o estado novo: arquivos que nenhum parcial usa mais.
+    usados = {p["inconsistencias"] for e in estado.values() for p in e["parciais"]}
+    for arq in pasta.iterdir():
+        if arq.name not in usados:
+            arq.unlink()
+
+    ordenado = sorted(soma.items(), key=lambda x: (x[0][1], x[0][2], x[0][0]))
+
+    # Com zip_path o CSV é compactado na mesma passada em que é gravado.
     consolidado = cons_dir / "consolidado.csv"
-    with consolidado.open("w", encoding="utf-8", newline="") as f:
+    with abrir_csv_saida(consolidado, zip_path, compressao) as f:
         w = csv.writer(f)
-        w.writerow(["RegistroANS", "RazaoSocial", "Trimestre", "Ano", "ValorDespesas"])
-        for (reg_ans, ano, tri), total in sorted(soma.items(), key=lambda x: (x[0][1], x[0][2], x[0][0])):
-            w.writerow([reg_ans, "", tri, ano, f"{total:.2f}"])
-
-    if inconsist:
-        vistos = set()
-        unicas = []
-        for d in inconsist:
-            chave = tuple(sorted((k, str(v)) for k, v in d.items()))
-            if chave not in vistos:
-                vistos.add(chave)
-                unicas.append(d)
-
-        inc = cons_dir / "inconsistencias.csv"
-        cols = sorted({k for d in unicas for k in d.keys()})
-        with inc.open("w", encoding="utf-8", newline="") as f:
-            dw = csv.DictWriter(f, fieldnames=cols)
-            dw.writeheader()
-            dw.writerows(unicas)
-    
+        w.writerow(CAMPOS_CONSOLIDADO)
+        for (reg_ans, ano, tri), total in ordenado:
+            w.writerow([reg_ans, "", tri, ano, formatar_centavos(total)])
+
+    if colunar:
+        # Mesmo conteúdo do CSV para as etapas seguintes, com o valor em centavos.
+        with abrir_escrita(cons_dir / f"consolidado{SUFIXO}", CAMPOS_CONSOLIDADO, ESQUEMA_DESPESAS) as w:
+            for (reg_ans, ano, tri), total in ordenado:
+                w.writerow(
+                    {
+                        "RegistroANS": reg_ans,
+                        "RazaoSocial": "",
+                        "Trimestre": tri,
+                        "Ano": ano,
+                        "ValorDespesas": Centavos(total),
+                    }
+                )
+
     return consolidado 
 
 
-def zipar_finalizado(consolidado_csv: Path, zip_path: Path) -> None:
-    with zipfile.ZipFile(zip_path, "w", compression=zipfile.ZIP_DEFLATED) as z:
+def zipar_finalizado(consolidado_csv: Path, zip_path: Path, compressao: str = "padrao") -> None:
+    with abrir_zip(zip_path, compressao) as z:
         z.write(consolidado_csv, arcname=consolidado_csv.name)
@@ -0,0 +1,242 @@
+import posixpath
+import zipfile
+from xml.etree.ElementTree import iterparse, parse
+
+from openpyxl.styles.numbers import builtin_format_code, is_date_format, is_timedelta_format
+from openpyxl.utils.datetime import CALENDAR_MAC_1904, WINDOWS_EPOCH, from_excel, from_ISO8601
+
+
+NS_MAIN = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+NS_REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+NS_PKG_REL = "http://schemas.openxmlformats.org/package/2006/relationships"
+
+TAG_SHEET_DATA = f"{{{NS_MAIN}}}sheetData"
+TAG_ROW = f"{{{NS_MAIN}}}row"
+TAG_C = f"{{{NS_MAIN}}}c"
+TAG_V = f"{{{NS_MAIN}}}v"
+TAG_IS = f"{{{NS_MAIN}}}is"
+TAG_T = f"{{{NS_MAIN}}}t"
+TAG_SI = f"{{{NS_MAIN}}}si"
+TAG_RPH = f"{{{NS_MAIN}}}rPh"
+TAG_NUM_FMT = f"{{{NS_MAIN}}}numFmt"
+TAG_CELL_XFS = f"{{{NS_MAIN}}}cellXfs"
+TAG_XF = f"{{{NS_MAIN}}}xf"
+
+
+class PlanilhaNaoSuportada(Exception):
+    pass
+
+
+def caminho_rel(base: str, alvo: str) -> str:
+    if alvo.startswith("/"):
+        return alvo.lstrip("/")
+    return posixpath.normpath(posixpath.join(posixpath.dirname(base), alvo))
+
+
+def ler_rels(z: zipfile.ZipFile, base: str) -> dict[str, tuple[str, str]]:
+    rels_path = posixpath.join(posixpath.dirname(base), "_rels", posixpath.basename(base) + ".rels")
+    try:
+        with z.open(rels_path) as f:
+            root = parse(f).getroot()
+    except KeyError:
+        return {}
+
+    rels = {}
+    for rel in root.iter(f"{{{NS_PKG_REL}}}Relationship"):
+        rels[rel.get("Id")] = (rel.get("Type", ""), caminho_rel(base, rel.get("Target", "")))
+    return rels
+
+
+def texto(elem) -> str:
+    partes = []
+    for filho in elem.iter():
+        if filho.tag == TAG_RPH:
+            break
+        if filho.tag == TAG_T and filho.text:
+            partes.append(filho.text)
+    return "".join(partes)
+
+
+def indice_coluna(ref: str) -> int:
+    n = 0
+    for ch in ref:
+        if "A" <= ch <= "Z":
+            n = n * 26 + (ord(ch) - 64)
+        else:
+            break
+    return n - 1
+
+
+def numero(v: str) -> int | float:
+    # Mesma conversão do openpyxl: com ponto/expoente vira float, senão int.
+    if "." in v or "E" in v or "e" in v:
+        return float(v)
+    return int(v)
+
+
+def estilos_de_data(z: zipfile.ZipFile, caminho: str) -> tuple[set[int], set[int]]:
+    # Índices de cellXfs com formato de data e de duração, pelo mesmo critério
+    # do openpyxl (só a primeira seção do formato conta).
+    try:
+        with z.open(caminho) as f:
+            root = parse(f).getroot()
+    except KeyError:
+        return set(), set()
+
+    personalizados = {int(n.get("numFmtId")): n.get("formatCode") for n in root.iter(TAG_NUM_FMT)}
+    datas = set()
+    duracoes = set()
+    xfs = root.find(TAG_CELL_XFS)
+    for idx, xf in enumerate(xfs.findall(TAG_XF) if xfs is not None else []):
+        num = int(xf.get("numFmtId", 0))
+        fmt = personalizados[num] if num in personalizados else builtin_format_code(num)
+        if is_date_format(fmt):
+            datas.add(idx)
+        if is_timedelta_format(fmt):
+            duracoes.add(idx)
+    return datas, duracoes
+
+
+class LeitorXlsx:
+    def __init__(self, arquivo):
+        self.z = zipfile.ZipFile(arquivo, "r")
+        self._compartilhadas = None
+        try:
+            self._carregar()
+        except BaseException:
+            # Quem chama cai no openpyxl e nunca recebe o leitor para fechar.
+            self.z.close()
+            raise
+
+    def _carregar(self) -> None:
+        try:
+            with self.z.open("xl/workbook.xml") as f:
+                workbook = parse(f).getroot()
+        except KeyError:
+            raise PlanilhaNaoSuportada("workbook.xml não encontrado")
+
+        if workbook.tag != f"{{{NS_MAIN}}}workbook":
+            raise PlanilhaNaoSuportada(f"namespace não suportado: {workbook.tag}")
+
+        rels = ler_rels(self.z, "xl/workbook.xml")
+
+        self.planilhas = []
+        for sheet in workbook.iter(f"{{{NS_MAIN}}}sheet"):
+            tipo, alvo = rels.get(sheet.get(f"{{{NS_REL}}}id"), ("", ""))
+            if not tipo.endswith("/worksheet"):
+                continue
+            if alvo not in self.z.NameToInfo:
+                raise PlanilhaNaoSuportada(f"planilha não encontrada: {alvo}")
+            self.planilhas.append(alvo)
+
+        self.caminho_compartilhadas = "xl/sharedStrings.xml"
+        caminho_estilos = "xl/styles.xml"
+        for tipo, alvo in rels.values():
+            if tipo.endswith("/sharedStrings"):
+                self.caminho_compartilhadas = alvo
+            elif tipo.endswith("/styles"):
+                caminho_estilos = alvo
+
+        # Números com estilo de data viram datetime no openpyxl; aqui também,
+        # para uma data na coluna de valor não virar um número de série.
+        self.estilos_data, self.estilos_duracao = estilos_de_data(self.z, caminho_estilos)
+        pr = workbook.find(f"{{{NS_MAIN}}}workbookPr")
+        data1904 = pr is not None and pr.get("date1904", "").lower() in ("1", "true")
+        self.epoca = CALENDAR_MAC_1904 if data1904 else WINDOWS_EPOCH
+
+    def close(self) -> None:
+        self.z.close()
+
+    def compartilhadas(self) -> list[str]:
+        if self._compartilhadas is None:
+            self._compartilhadas = []
+            if self.caminho_compartilhadas in self.z.NameToInfo:
+                with self.z.open(self.caminho_compartilhadas) as f:
+                    for _, elem in iterparse(f):
+                        if elem.tag == TAG_SI:
+                            self._compartilhadas.append(texto(elem))
+                            elem.clear()
+        return self._compartilhadas
+
+    def valor(self, c) -> str | None:
+        tipo = c.get("t", "n")
+
+        if tipo == "inlineStr":
+            is_ = c.find(TAG_IS)
+            return texto(is_) if is_ is not None else None
+
+        v = c.find(TAG_V)
+        if v is None or v.text is None:
+            return None
+
+        if tipo == "s":
+            return self.compartilhadas()[int(v.text)]
+        if tipo == "n":
+            n = numero(v.text)
+            estilo = int(c.get("s") or 0)
+            if estilo in self.estilos_data:
+                try:
+                    return str(from_excel(n, self.epoca, timedelta=estilo in self.estilos_duracao))
+                except (OverflowError, ValueError):
+                    return "#VALUE!"
+            return str(n)
+        if tipo == "b":
+            return str(bool(int(v.text)))
+        if tipo == "d":
+            return str(from_ISO8601(v.text))
+        return v.text
+
+    def linhas(self, planilha: str, colunas: set[int] | None = None):
+        largura = max(colunas) + 1 if colunas else 0
+
+        with self.z.open(planilha) as f:
+            dados = None
+            for evento, elem in iterparse(f, events=("start", "end")):
+                if evento == "start":
+                    if elem.tag == TAG_SHEET_DATA:
+                        dados = elem
+                    continue
+                if elem.tag != TAG_ROW:
+                    continue
+
+                linha = [None] * largura if colunas is not None else []
+                i = -1
+                for c in elem.iter(TAG_C):
+                    ref = c.get("r")
+                    i = indice_coluna(ref) if ref else i + 1
+                    if colunas is not None:
+                        if i not in colunas:
+                            continue
+                    elif i >= len(linha):
+                        linha.extend([None] * (i + 1 - len(linha)))
+                    linha[i] = self.valor(c)
+
+                numero_linha = int(elem.get("r") or 0)
+                if dados is not None:
+                    dados.remove(elem)
+                yield numero_linha, linha
+
+    def tabelas(self, colunas_de):
+        for planilha in self.planilhas:
+            it = self.linhas(planilha)
+            try:
+                numero_linha, cabecalho = next(it)
+            except StopIteration:
+                continue
+            it.close()
+
+            # O openpyxl considera sempre a linha 1 como cabeçalho.
+            if numero_linha > 1:
+                cabecalho = []
+            cols = [c.strip() if c is not None else "" for c in cabecalho]
+
+            yield cols, self.linhas_dados(planilha, colunas_de(cols))
+
+    def linhas_dados(self, planilha: str, colunas: set[int]):
+        it = self.linhas(planilha, colunas)
+        for numero_linha, linha in it:
+            if numero_linha > 1:
+                yield linha
+            break
+        for _, linha in it:
+            yield linha
@@ -0,0 +1,95 @@
+import math
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+
+
+# Valores monetários em centavos inteiros, para somar sem erro de ponto
+# flutuante. Aceita formato brasileiro e internacional:
+#   - com "." e ",", o separador que aparece por último é o decimal;
+#   - com um só tipo de separador, uma ocorrência é decimal e várias são
+#     separadores de milhar ("1.234.567" -> 1234567,00);
+#   - com ponto_milhar, um "." único seguido de exatamente três dígitos é
+#     separador de milhar ("150.000" -> 150000,00). É o caso dos arquivos da
+#     ANS (processa_dados); os CSVs gerados pelo próprio pipeline e lidos
+#     pela validação, agregação e backend usam "." decimal e não o passam.
+# Casas além da segunda são arredondadas (meio para longe do zero).
+
+
+class Centavos(int):
+    # Valor que já está em centavos (ex.: lido de uma coluna "centavos" do
+    # formato colunar): parse_centavos o devolve como está, em vez de tratá-lo
+    # como reais inteiros.
+    __slots__ = ()
+
+
+def centavos_decimal(s: str) -> int | None:
+    try:
+        d = Decimal(s)
+    except InvalidOperation:
+        return None
+    if not d.is_finite():
+        return None
+    return int((d * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def parse_centavos(v, ponto_milhar: bool = False) -> int | None:
+    if v is None:
+        return None
+    if isinstance(v, Centavos):
+        return int(v)
+    if isinstance(v, int):
+        return v * 100
+    if isinstance(v, float):
+        return None if not math.isfinite(v) else centavos_decimal(repr(v))
+
+    original = s = str(v).strip()
+    if not s:
+        return None
+
+    # Caminho rápido para o formato mais comum: "-1234,56" / "1234.56".
+    # isdigit() aceita dígitos não ASCII ("²", "١"), por isso o isascii().
+    if len(s) > 3 and s[-3] in ",." and s.isascii() and s[-2:].isdigit():
+        cab = s[:-3]
+        if cab.isdigit() or (cab[:1] == "-" and cab[1:].isdigit()):
+            return int(cab + s[-2:])
+
+    negativo = s[0] == "-"
+    if s[0] in "+-":
+        s = s[1:]
+
+    virgula = s.rfind(",")
+    ponto = s.rfind(".")
+    if virgula >= 0 and ponto >= 0:
+        pos = max(virgula, ponto)
+        inteiro = s[:pos].replace(".", "").replace(",", "")
+        frac = s[pos + 1:]
+    elif virgula >= 0 or ponto >= 0:
+        sep = "," if virgula >= 0 else "."
+        pos = max(virgula, ponto)
+        if s.find(sep) == pos and not (ponto_milhar and sep == "." and len(s) - pos == 4):
+            inteiro = s[:pos]
+            frac = s[pos + 1:]
+        else:
+            inteiro = s.replace(sep, "")
+            frac = ""
+    else:
+        inteiro = s
+        frac = ""
+
+    if not (inteiro or frac) or not (inteiro.isascii() and frac.isascii()):
+        return None
+    if not ((not inteiro or inteiro.isdigit()) and (not frac or frac.isdigit())):
+        # Notação científica e afins ficam com o Decimal.
+        return centavos_decimal(original)
+
+    c = int(inteiro or "0") * 100
+    if frac:
+        c += int(frac[:2].ljust(2, "0"))
+        if len(frac) > 2 and frac[2] >= "5":
+            c += 1
+    return -c if negativo else c
+
+
+def formatar_centavos(c: int) -> str:
+    sinal = "-" if c < 0 else ""
+    reais, cent = divmod(abs(c), 100)
+    return f"{sinal}{reais}.{cent:02d}"
@@ -0,0 +1,345 @@
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+
+from ans_dados.agrega_dados import agregar_despesas
+from ans_dados.ans_source import BASE_URL, download_zips, get_latest_zip_urls
+from ans_dados.colunar import SUFIXO
+from ans_dados.consolida_dados import gerar_finalizado
+from ans_dados.enriquece_dados import enriquecer_consolidado
+from ans_dados.processa_dados import BLOCO_LEITURA, novas_estatisticas
+from ans_dados.registro_operadoras import RegistroOperadoras, atualizar_cadastro
+from ans_dados.saida_zip import COMPRESSOES
+from ans_dados.valida_dados import validar_dados
+
+
+DOCS = Path(".documentos")
+ESTADO_PIPELINE = DOCS / "pipeline.json"
+VERSAO_ESTADO = 1
+
+PASTA_MODULOS = Path(__file__).parent
+
+
+class Etapa:
+    def __init__(
+        self,
+        nome: str,
+        funcao,
+        entradas: list[Path] = (),
+        saidas: list[Path] = (),
+        parametros: dict | None = None,
+        opcoes: dict | None = None,
+        depende: list[str] = (),
+        codigo: list[str] = (),
+        sempre: bool = False,
+    ):
+        self.nome = nome
+        self.funcao = funcao
+        self.entradas = list(entradas)
+        self.saidas = list(saidas)
+        # parametros entram na chave de cache; opcoes (ex.: jobs) não mudam o
+        # resultado e ficam de fora.
+        self.parametros = parametros or {}
+        self.opcoes = opcoes or {}
+        self.depende = list(depende)
+        self.codigo = list(codigo)
+        self.sempre = sempre
+
+    def executar(self) -> None:
+        self.funcao(**self.parametros, **self.opcoes)
+
+
+class Hashes:
+    # sha256 de arquivos, reaproveitado enquanto tamanho e mtime não mudam.
+    def __init__(self, memo: dict):
+        self.memo = memo
+        self.lock = threading.Lock()
+
+    def arquivo(self, path: Path) -> str:
+        st = path.stat()
+        chave = str(path)
+        with self.lock:
+            antes = self.memo.get(chave)
+        if antes and antes["tamanho"] == st.st_size and antes["mtime_ns"] == st.st_mtime_ns:
+            return antes["sha256"]
+
+        h = hashlib.sha256()
+        with path.open("rb") as f:
+            while bloco := f.read(BLOCO_LEITURA):
+                h.update(bloco)
+
+        with self.lock:
+            self.memo[chave] = {"tamanho": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": h.hexdigest()}
+        return h.hexdigest()
+
+    def caminho(self, path: Path) -> str | None:
+        if path.is_file():
+            return self.arquivo(path)
+        if not path.is_dir():
+            return None
+
+        h = hashlib.sha256()
+        for arq in sorted(p for p in path.rglob("*") if p.is_file() and relevante(p)):
+            h.update(f"{arq.relative_to(path).as_posix()}\0{self.arquivo(arq)}\n".encode())
+        return h.hexdigest()
+
+
+def relevante(path: Path) -> bool:
+    nome = path.name
+    return not nome.startswith(".") and not nome.endswith((".part", ".part.json", ".tmp"))
+
+
+def chave_etapa(etapa: Etapa, hashes: Hashes) -> str:
+    h = hashlib.sha256()
+    h.update(etapa.nome.encode())
+    h.update(json.dumps(etapa.parametros, sort_keys=True, default=str).encode())
+    for modulo in etapa.codigo:
+        h.update(hashes.arquivo(PASTA_MODULOS / modulo).encode())
+    for entrada in etapa.entradas:
+        h.update(f"{entrada}\0{hashes.caminho(entrada)}\n".encode())
+    return h.hexdigest()
+
+
+def em_dia(etapa: Etapa, chave: str, anterior: dict | None, hashes: Hashes) -> bool:
+    if etapa.sempre or not anterior or anterior.get("chave") != chave:
+        return False
+    for saida in etapa.saidas:
+        if hashes.caminho(saida) != anterior["saidas"].get(str(saida)):
+            return False
+    return True
+
+
+def carregar_estado(path: Path) -> dict:
+    if not path.exists():
+        return {}
+    try:
+        estado = json.loads(path.read_text(encoding="utf-8"))
+    except ValueError:
+        return {}
+    return estado if estado.get("versao") == VERSAO_ESTADO else {}
+
+
+def salvar_estado(path: Path, estado: dict) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps({**estado, "versao": VERSAO_ESTADO}, indent=2, sort_keys=True), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def executar(etapas: list[Etapa], estado_path: Path = ESTADO_PIPELINE, jobs: int = 2, forcar: set[str] = frozenset()) -> dict[str, str]:
+    por_nome = {e.nome: e for e in etapas}
+    for e in etapas:
+        for dep in e.depende:
+            if dep not in por_nome:
+                raise ValueError(f"Etapa {e.nome} depende de etapa desconhecida: {dep}")
+
+    estado = carregar_estado(estado_path)
+    cache_etapas = estado.setdefault("etapas", {})
+    hashes = Hashes(estado.setdefault("hashes", {}))
+    lock = threading.Lock()
+
+    def rodar(etapa: Etapa) -> str:
+        chave = chave_etapa(etapa, hashes)
+        with lock:
+            anterior = cache_etapas.get(etapa.nome)
+        if etapa.nome not in forcar and em_dia(etapa, chave, anterior, hashes):
+            return "em dia"
+
+        inicio = time.time()
+        etapa.executar()
+        saidas = {str(s): hashes.caminho(s) for s in etapa.saidas}
+        with lock:
+            cache_etapas[etapa.nome] = {"chave": chave, "saidas": saidas}
+            salvar_estado(estado_path, estado)
+        return f"executada em {time.time() - inicio:.1f}s"
+
+    # Roda em paralelo todas as etapas cujas dependências já terminaram.
+    resultado: dict[str, str] = {}
+    pendentes = list(etapas)
+    em_execucao = {}
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        while pendentes or em_execucao:
+            for etapa in list(pendentes):
+                if all(dep in resultado for dep in etapa.depende):
+                    pendentes.remove(etapa)
+                    em_execucao[pool.submit(rodar, etapa)] = etapa
+
+            if not em_execucao:
+                raise ValueError("Dependência circular entre etapas: " + ", ".join(e.nome for e in pendentes))
+
+            prontos, _ = wait(em_execucao, return_when=FIRST_COMPLETED)
+            for fut in prontos:
+                etapa = em_execucao.pop(fut)
+                resultado[etapa.nome] = fut.result()
+                print(f"[{etapa.nome}] {resultado[etapa.nome]}")
+
+    salvar_estado(estado_path, estado)
+    return resultado
+
+
+def etapa_baixar_zips(zips_dir: Path, trimestres: int) -> None:
+    urls = get_latest_zip_urls(BASE_URL, trimestres)
+    download_zips(urls, zips_dir)
+
+
+def etapa_consolidar(
+    zips_dir: Path,
+    cons_dir: Path,
+    zip_saida: Path,
+    colunar: bool,
+    compressao: str,
+    jobs: int,
+    pre_filtro: bool,
+) -> None:
+    estatisticas = novas_estatisticas()
+    gerar_finalizado(
+        zips_dir,
+        cons_dir,
+        estatisticas,
+        jobs=jobs,
+        pre_filtro=pre_filtro,
+        colunar=colunar,
+        zip_path=zip_saida,
+        compressao=compressao,
+    )
+    (cons_dir / "estatisticas.json").write_text(json.dumps(estatisticas, indent=2), encoding="utf-8")
+
+
+def etapa_cadastro(cadastro_csv: Path) -> None:
+    # Revalida o cadastro e já deixa o índice pronto para o enriquecimento.
+    atualizar_cadastro(cadastro_csv)
+    RegistroOperadoras(cadastro_csv).close()
+
+
+def etapas_padrao(
+    jobs: int = 1,
+    pre_filtro: bool = False,
+    trimestres: int = 3,
+    colunar: bool = False,
+    memoria_agregacao: float | None = None,
+    compressao: str = "padrao",
+) -> list[Etapa]:
+    # Com colunar=True os arquivos entre etapas usam o formato binário de
+    # ans_dados.colunar; as saídas finais continuam em CSV.
+    ext = SUFIXO if colunar else ".csv"
+    formato = "colunar" if colunar else "csv"
+
+    zips_dir = DOCS / "zips"
+    cons_dir = DOCS / "filtrado"
+    cadastro_csv = DOCS / "cadastro" / "Relatorio_cadop.csv"
+    consolidado = cons_dir / f"consolidado{ext}"
+    enriquecido = cons_dir / f"consolidado_enriquecido{ext}"
+    validacao_dir = DOCS / "validacao"
+    validado = validacao_dir / f"consolidado_validado{ext}"
+    agregado_dir = DOCS / "agregado"
+
+    return [
+        Etapa(
+            "baixar_zips",
+            etapa_baixar_zips,
+            saidas=[zips_dir],
+            parametros={"zips_dir": zips_dir, "trimestres": trimestres},
+            codigo=["ans_source.py"],
+            sempre=True,
+        ),
+        Etapa(
+            "baixar_cadastro",
+            etapa_cadastro,
+            saidas=[cadastro_csv],
+            parametros={"cadastro_csv": cadastro_csv},
+            codigo=["registro_operadoras.py", "ans_source.py"],
+            sempre=True,
+        ),
+        Etapa(
+            "consolidar",
+            etapa_consolidar,
+            entradas=[zips_dir],
+            saidas=[consolidado, Path("consolidado_despesas.zip")],
+            parametros={
+                "zips_dir": zips_dir,
+                "cons_dir": cons_dir,
+                "zip_saida": Path("consolidado_despesas.zip"),
+                "colunar": colunar,
+                "compressao": compressao,
+            },
+            opcoes={"jobs": jobs, "pre_filtro": pre_filtro},
+            depende=["baixar_zips"],
+            codigo=[
+                "processa_dados.py",
+                "leitor_xlsx.py",
+                "consolida_dados.py",
+                "numeros.py",
+                "colunar.py",
+                "saida_zip.py",
+            ],
+        ),
+        Etapa(
+            "enriquecer",
+            enriquecer_consolidado,
+            entradas=[consolidado, cadastro_csv],
+            saidas=[enriquecido],
+            parametros={"consolidado_csv": consolidado, "cadastro_csv": cadastro_csv, "out_csv": enriquecido},
+            depende=["consolidar", "baixar_cadastro"],
+            codigo=["enriquece_dados.py", "registro_operadoras.py", "ans_source.py", "colunar.py"],
+        ),
+        Etapa(
+            "validar",
+            validar_dados,
+            entradas=[enriquecido],
+            saidas=[validado, validacao_dir / "erros_validacao.csv", validacao_dir / "regras_validacao.json"],
+            parametros={"consolidado_csv": enriquecido, "out_dir": validacao_dir, "formato": formato},
+            opcoes={"jobs": jobs},
+            depende=["enriquecer"],
+            codigo=["valida_dados.py", "ans_source.py", "numeros.py", "colunar.py"],
+        ),
+        Etapa(
+            "agregar",
+            agregar_despesas,
+            entradas=[validado],
+            saidas=[agregado_dir / "despesas_agregadas.csv", Path("Teste_GuilhermeBurgheri.zip")],
+            parametros={
+                "consolidado_validado_csv": validado,
+                "out_dir": agregado_dir,
+                "zip_path": Path("Teste_GuilhermeBurgheri.zip"),
+                "compressao": compressao,
+            },
+            opcoes={"limite_memoria_mb": memoria_agregacao},
+            depende=["validar"],
+            codigo=["agrega_dados.py", "numeros.py", "colunar.py", "saida_zip.py"],
+        ),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Executa todas as etapas, pulando as que já estão em dia")
+    parser.add_argument("--jobs", type=int, default=1, help="processos para ler os arquivos da ANS")
+    parser.add_argument("--etapas-paralelas", type=int, default=2, help="etapas independentes executadas ao mesmo tempo")
+    parser.add_argument("--pre-filtro", action="store_true", help="pré-filtro em bytes na leitura dos CSV/TXT")
+    parser.add_argument("--colunar", action="store_true", help="arquivos intermediários no formato colunar binário")
+    parser.add_argument(
+        "--memoria-agregacao",
+        type=float,
+        default=None,
+        help="limite em MB para a agregação; acima dele usa arquivos temporários",
+    )
+    parser.add_argument("--compressao", choices=list(COMPRESSOES), default="padrao", help="compressão dos zips de saída")
+    parser.add_argument("--forcar", nargs="*", default=[], help="etapas a executar mesmo se estiverem em dia")
+    args = parser.parse_args()
+
+    etapas = etapas_padrao(
+        jobs=args.jobs,
+        pre_filtro=args.pre_filtro,
+        colunar=args.colunar,
+        memoria_agregacao=args.memoria_agregacao,
+        compressao=args.compressao,
+    )
+    executar(etapas, jobs=args.etapas_paralelas, forcar=set(args.forcar))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,29 @@
 import re 
+import codecs
 import csv
+import io
 import zipfile
+from contextlib import contextmanager
 from pathlib import Path
 from openpyxl import load_workbook
 
+from ans_dados.leitor_xlsx import LeitorXlsx, PlanilhaNaoSuportada
+from ans_dados.numeros import parse_centavos
+
 
 CHAVES = ("evento", "sinistro", "eventos", "sinistros")
+RE_CHAVES_BYTES = re.compile(b"|".join(re.escape(k.encode()) for k in CHAVES))
 SAIDAS_ACEITAS = (".csv", ".txt", ".xlsx", ".xlsm")
 
+CHAVES_DESCRICAO = ("descricao", "ds_conta", "descricao_conta", "conta")
+CHAVES_VALOR = ("vl_saldo_final", "valor", "vl", "valor_despesas", "vl_despesas")
+CHAVES_OPERADORA = ("cnpj", "reg_ans", "registroans", "registro_ans")
+
+TAMANHO_PEDACO = 64 * 1024 * 1024
+BLOCO_LEITURA = 8 * 1024 * 1024
+AMOSTRA_FORMATO = 64 * 1024
+BLOCO_FILTRO = 1024 * 1024
+
 
 def extrair_zips(zips_dir: Path, destino: Path) -> None:
     destino.mkdir(parents=True, exist_ok=True)
@@ -20,6 +36,53 @@ def extrair_zips(zips_dir: Path, destino: Path) -> None:
             z.extractall(pasta)
 
 
+def listar_fontes(base_dir: Path):
+    for arq in base_dir.rglob("*"):
+        if not arq.is_file():
+            continue
+
+        if arq.suffix.lower() == ".zip":
+            with zipfile.ZipFile(arq, "r") as z:
+                membros = [i.filename for i in z.infolist() if not i.is_dir()]
+            for membro in membros:
+                if Path(membro).suffix.lower() in SAIDAS_ACEITAS:
+                    yield (arq, membro)
+        elif arq.suffix.lower() in SAIDAS_ACEITAS:
+            yield arq
+
+
+def nome_fonte(fonte) -> str:
+    if isinstance(fonte, tuple):
+        zip_path, membro = fonte
+        return f"{zip_path}!{membro}"
+    return str(fonte)
+
+
+def sufixo_fonte(fonte) -> str:
+    if isinstance(fonte, tuple):
+        return Path(fonte[1]).suffix.lower()
+    return fonte.suffix.lower()
+
+
+def tamanho_fonte(fonte) -> int:
+    if isinstance(fonte, tuple):
+        zip_path, membro = fonte
+        with zipfile.ZipFile(zip_path, "r") as z:
+            return z.getinfo(membro).file_size
+    return fonte.stat().st_size
+
+
+@contextmanager
+def abrir_fonte(fonte):
+    if isinstance(fonte, tuple):
+        zip_path, membro = fonte
+        with zipfile.ZipFile(zip_path, "r") as z, z.open(membro, "r") as f:
+            yield f
+    else:
+        with fonte.open("rb") as f:
+            yield f
+
+
 def slug(s: str) -> str:
     s = (s or "").strip().lower().lstrip("\ufeff").strip('"').strip("'")
     s = re.sub(r"[^a-z0-9]+", "_", s)
@@ -31,34 +94,268 @@ def tem_evento_sinistro(texto: str) -> bool:
     return any(k in t for k in CHAVES)
 
 
-def parse_valor(v) -> float | None:
-    if v is None:
-        return None
-    s = str(v).strip()
-    if not s:
-        return None
-    s = s.replace(".", "").replace(",", ".")
-    try:
-        return float(s)
-    except Exception:
-        return None
+class LeitorTrecho(io.RawIOBase):
+    def __init__(self, f, tamanho: int | None):
+        self.f = f
+        self.restante = tamanho
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        n = len(b) if self.restante is None else min(len(b), self.restante)
+        dados = self.f.read(n)
+        b[:len(dados)] = dados
+        if self.restante is not None:
+            self.restante -= len(dados)
+        return len(dados)
 
 
-def linhas_csv_ou_txt(path: Path):
+def dividir_fonte(fonte, tamanho_pedaco: int | None = None) -> list[tuple[int, int | None] | None]:
+    # Só arquivos soltos são divididos: num membro de zip cada seek() teria
+    # que descompactar de novo tudo o que vem antes do pedaço.
+    tamanho_pedaco = tamanho_pedaco or TAMANHO_PEDACO
+    if isinstance(fonte, tuple) or sufixo_fonte(fonte) not in (".csv", ".txt"):
+        return [None]
+    if tamanho_fonte(fonte) <= tamanho_pedaco:
+        return [None]
+
+    # Procura fins de registro (quebra de linha fora de aspas) perto de cada
+    # múltiplo de tamanho_pedaco. O primeiro corte é o fim do cabeçalho.
+    cortes = []
+    alvo = 0
+    pos = 0
+    aspas = 0
+    with abrir_fonte(fonte) as f:
+        while True:
+            bloco = f.read(BLOCO_LEITURA)
+            if not bloco:
+                break
+
+            i = alvo - pos
+            if 0 <= i < len(bloco):
+                paridade = aspas + bloco.count(b'"', 0, i)
+                while True:
+                    j = bloco.find(b"\n", i)
+                    if j < 0:
+                        alvo = pos + len(bloco)
+                        break
+                    paridade += bloco.count(b'"', i, j)
+                    i = j + 1
+                    if paridade % 2 == 0:
+                        cortes.append(pos + i)
+                        alvo = pos + i + tamanho_pedaco
+                        if alvo - pos >= len(bloco):
+                            break
+                        paridade += bloco.count(b'"', i, alvo - pos)
+                        i = alvo - pos
+
+            aspas += bloco.count(b'"')
+            pos += len(bloco)
+
+    if len(cortes) < 2:
+        return [None]
+
+    return [(ini, fim) for ini, fim in zip(cortes, cortes[1:])] + [(cortes[-1], None)]
+
+
+def detectar_formato(fonte) -> tuple[str, str]:
+    with abrir_fonte(fonte) as fb:
+        amostra = fb.read(AMOSTRA_FORMATO)
+
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(amostra, final=False)
+        encoding = "utf-8"
+    except UnicodeDecodeError:
+        encoding = "latin-1"
+
+    texto = amostra.decode(encoding, errors="ignore")
     for delim in (";", ",", "\t"):
+        for cabecalho in csv.reader(io.StringIO(texto, newline=""), delimiter=delim):
+            if cabecalho:
+                if len(cabecalho) > 1:
+                    return encoding, delim
+                break
+
+    raise ValueError(f"Não foi possível identificar o delimitador de {nome_fonte(fonte)}")
+
+
+def tem_chave_bytes(bloco: bytes) -> bool:
+    return RE_CHAVES_BYTES.search(bloco) is not None
+
+
+def candidatos_do_bloco(bloco: bytes) -> list[tuple[int, bytes]] | None:
+    # Caminho rápido: localiza as chaves no bloco inteiro e recorta só as
+    # linhas onde aparecem. Devolve None se alguma dessas linhas não for um
+    # registro completo (aspas abertas), para o chamador ler linha a linha.
+    baixo = bloco.lower()
+    encontrados = []
+    paridade = 0
+    anterior = 0
+    fim = 0
+    for m in RE_CHAVES_BYTES.finditer(baixo):
+        if m.start() < fim:
+            continue
+        inicio = baixo.rfind(b"\n", 0, m.start()) + 1
+        fim = baixo.find(b"\n", m.end()) + 1 or len(baixo)
+
+        paridade += bloco.count(b'"', anterior, inicio)
+        linha = bloco[inicio:fim]
+        if paridade % 2 or linha.count(b'"') % 2:
+            return None
+        paridade += linha.count(b'"')
+        anterior = fim
+        encontrados.append((inicio, linha))
+    return encontrados
+
+
+def registros_candidatos(fb, pular_cabecalho: bool):
+    # Junta linhas em registros (quebras de linha dentro de aspas continuam o
+    # registro) e devolve só os que contêm alguma das CHAVES, sem decodificar
+    # nem passar pelo csv os demais. Cada registro vem com a posição em que
+    # começa em fb.
+    partes = None
+    inicio_partes = 0
+    resto = b""
+    base = 0
+
+    while True:
+        bloco = fb.read(BLOCO_FILTRO)
+        if bloco:
+            bloco = resto + bloco
+            corte = bloco.rfind(b"\n") + 1
+            if corte == 0:
+                resto = bloco
+                continue
+            bloco, resto = bloco[:corte], bloco[corte:]
+        elif resto:
+            bloco, resto = resto, b""
+        else:
+            break
+        pos = base
+        base += len(bloco)
+
+        if partes is None and not pular_cabecalho and bloco.count(b'"') % 2 == 0:
+            encontrados = candidatos_do_bloco(bloco)
+            if encontrados is not None:
+                for i, linha in encontrados:
+                    yield pos + i, linha
+                continue
+
+        inicio = 0
+        while inicio < len(bloco):
+            fim = bloco.find(b"\n", inicio) + 1 or len(bloco)
+            linha = bloco[inicio:fim]
+            inicio_linha = pos + inicio
+            inicio = fim
+
+            impar = linha.count(b'"') % 2
+            if partes is not None:
+                partes.append(linha)
+                if not impar:
+                    continue
+                linha = b"".join(partes)
+                inicio_linha = inicio_partes
+                partes = None
+            elif impar:
+                partes = [linha]
+                inicio_partes = inicio_linha
+                continue
+
+            if pular_cabecalho:
+                if linha.strip():
+                    pular_cabecalho = False
+                continue
+
+            if tem_chave_bytes(linha.lower()):
+                yield inicio_linha, linha
+
+    if partes is not None:
+        linha = b"".join(partes)
+        if not pular_cabecalho and tem_chave_bytes(linha.lower()):
+            yield inicio_partes, linha
+
+
+def linhas_pre_filtradas(fonte, trecho, encoding: str, delim: str):
+    # A junção por paridade de aspas erra com uma aspa solta no meio de um
+    # campo: o registro junta várias linhas e o csv recusa a quebra de linha
+    # fora de aspas. Nesse caso o resto do trecho, a partir desse registro,
+    # é lido sem o pré-filtro, como faria o leitor normal.
+    inicio, fim = trecho or (0, None)
+    atual = inicio
+
+    def textos(bruto):
+        nonlocal atual
+        for pos, registro in registros_candidatos(bruto, pular_cabecalho=trecho is None):
+            atual = inicio + pos
+            yield registro.decode(encoding, errors="ignore")
+
+    with abrir_fonte(fonte) as fb:
+        fb.seek(inicio)
+        bruto = io.BufferedReader(LeitorTrecho(fb, None if fim is None else fim - inicio))
         try:
-            with path.open("r", encoding="utf-8", errors="ignore", newline="") as f:
-                r = csv.DictReader(f, delimiter=delim)
-                if r.fieldnames and len(r.fieldnames) > 1:
-                    for row in r:
-                        yield row
-                    return
-        except Exception:
+            yield from csv.reader(textos(bruto), delimiter=delim)
+            return
+        except csv.Error:
             pass
 
+    with abrir_fonte(fonte) as fb:
+        fb.seek(atual)
+        bruto = io.BufferedReader(LeitorTrecho(fb, None if fim is None else fim - atual))
+        f = io.TextIOWrapper(bruto, encoding=encoding, errors="ignore", newline="")
+        yield from csv.reader(f, delimiter=delim)
+
+
+def tabelas_csv_ou_txt(
+    fonte,
+    trecho: tuple[int, int | None] | None = None,
+    pre_filtro: bool = False,
+):
+    encoding, delim = detectar_formato(fonte)
+
+    with abrir_fonte(fonte) as fb:
+        f = io.TextIOWrapper(fb, encoding=encoding, errors="ignore", newline="")
+        linhas = csv.reader(f, delimiter=delim)
+        cabecalho = next(r for r in linhas if r)
+
+        if trecho is None and not pre_filtro:
+            yield cabecalho, linhas
+            return
+
+    if pre_filtro:
+        yield cabecalho, linhas_pre_filtradas(fonte, trecho, encoding, delim)
+        return
+
+    inicio, fim = trecho
+    with abrir_fonte(fonte) as fb:
+        fb.seek(inicio)
+        bruto = io.BufferedReader(LeitorTrecho(fb, None if fim is None else fim - inicio))
+        f = io.TextIOWrapper(bruto, encoding=encoding, errors="ignore", newline="")
+        yield cabecalho, csv.reader(f, delimiter=delim)
+
+
+def tabelas_xlsx(fonte):
+    if isinstance(fonte, tuple):
+        with abrir_fonte(fonte) as f:
+            fonte = io.BytesIO(f.read())
+
+    try:
+        leitor = LeitorXlsx(fonte)
+    except PlanilhaNaoSuportada:
+        yield from tabelas_openpyxl(fonte)
+        return
+
+    try:
+        yield from leitor.tabelas(colunas_do_plano)
+    finally:
+        leitor.close()
+
+
+def tabelas_openpyxl(fonte):
+    if isinstance(fonte, io.BytesIO):
+        fonte.seek(0)
 
-def linhas_xlsx(path: Path):
-    wb = load_workbook(path, read_only=True, data_only=True)
+    wb = load_workbook(fonte, read_only=True, data_only=True)
     for ws in wb.worksheets:
         it = ws.iter_rows(values_only=True)
         try:
@@ -67,58 +364,123 @@ def linhas_xlsx(path: Path):
             continue
 
         cols = [str(c).strip() if c is not None else "" for c in header]
+        yield cols, it
 
-        for row in it:
-            d = {}
-            for i, v in enumerate(row):
-                if i >= len(cols):
-                    break
-                d[cols[i]] = "" if v is None else str(v)
-            yield d
 
+def compilar_plano(cabecalho: list[str]) -> dict:
+    # Mesma resolução de colunas de um dict {slug(coluna): valor} montado por
+    # linha: em nomes repetidos vale a última coluna.
+    ultima = {}
+    for i, coluna in enumerate(cabecalho):
+        ultima[coluna] = i
 
-def filtrar_eventos_sinistros(base_dir: Path):
-    desc_keys = ("descricao", "ds_conta", "descricao_conta", "conta")
-    val_keys = ("vl_saldo_final", "valor", "vl", "valor_despesas", "vl_despesas")
+    por_slug = {}
+    for coluna, i in ultima.items():
+        por_slug[slug(str(coluna))] = i
 
-    for arq in base_dir.rglob("*"):
-        if not arq.is_file() or arq.suffix.lower() not in SAIDAS_ACEITAS:
-            continue
+    def indices(chaves):
+        return tuple(por_slug[k] for k in chaves if k in por_slug)
 
-        linhas = linhas_csv_ou_txt(arq) if arq.suffix.lower() in (".csv", ".txt") else linhas_xlsx(arq)
+    return {
+        "descricao": indices(CHAVES_DESCRICAO),
+        "valor": indices(CHAVES_VALOR),
+        "operadora": indices(CHAVES_OPERADORA),
+    }
+
+
+def colunas_do_plano(cabecalho: list[str]) -> set[int]:
+    plano = compilar_plano(cabecalho)
+    return {i for indices in plano.values() for i in indices}
+
+
+def campo(row, i: int):
+    if i >= len(row):
+        return None
+    v = row[i]
+    if v is None:
+        return ""
+    return v if isinstance(v, str) else str(v)
+
+
+def novas_estatisticas() -> dict:
+    return {
+        "arquivos_lidos": 0,
+        "arquivos_com_eventos": 0,
+        "linhas_com_eventos": 0,
+        "falhas_leitura": 0,
+        "arquivos_reprocessados": 0,
+        "inconsistencias_por_tipo": {},
+    }
 
-        for row in linhas:
-            norm = {slug(str(k)): v for k, v in row.items()}
 
+def filtrar_fonte(
+    fonte,
+    trecho: tuple[int, int | None] | None = None,
+    pre_filtro: bool = False,
+):
+    arquivo = nome_fonte(fonte)
+    tabelas = tabelas_csv_ou_txt(fonte, trecho, pre_filtro) if sufixo_fonte(fonte) in (".csv", ".txt") else tabelas_xlsx(fonte)
+
+    for cabecalho, linhas in tabelas:
+        plano = compilar_plano(cabecalho)
+        idx_desc = plano["descricao"]
+        idx_valor = plano["valor"]
+        idx_oper = plano["operadora"]
+
+        for row in linhas:
             descricao = ""
-            for k in desc_keys:
-                if norm.get(k):
-                    descricao = str(norm.get(k))
+            for i in idx_desc:
+                v = campo(row, i)
+                if v:
+                    descricao = v
                     break
             if not tem_evento_sinistro(descricao):
                 continue
 
             valor_raw = None
-            for k in val_keys:
-                if norm.get(k) not in (None, ""):
-                    valor_raw = norm.get(k)
+            for i in idx_valor:
+                v = campo(row, i)
+                if v not in (None, ""):
+                    valor_raw = v
                     break
 
-            valor = parse_valor(valor_raw)
+            valor = parse_centavos(valor_raw, ponto_milhar=True)
             if valor is None:
                 continue
 
-            id_oper = str( norm.get("cnpj") or
-            norm.get("reg_ans") or
-            norm.get("registroans") or
-            norm.get("registro_ans") or
-            "" ).strip()
-            
-            yield {"arquivo": str(arq), "id_operadora": id_oper, "descricao": descricao, "valor": valor}
+            id_oper = ""
+            for i in idx_oper:
+                v = campo(row, i)
+                if v:
+                    id_oper = v
+                    break
+
+            yield {"arquivo": arquivo, "id_operadora": id_oper.strip(), "descricao": descricao, "valor": valor}
+
+
+def filtrar_eventos_sinistros(base_dir: Path, estatisticas: dict | None = None):
+    if estatisticas is None:
+        estatisticas = novas_estatisticas()
+
+    for fonte in listar_fontes(base_dir):
+        estatisticas["arquivos_lidos"] += 1
+        # As linhas de um arquivo só saem depois que ele foi lido até o fim;
+        # se a leitura falhar no meio, nenhuma delas é usada.
+        try:
+            itens = list(filtrar_fonte(fonte))
+        except Exception as e:
+            print(f"Falha ao ler {nome_fonte(fonte)}: {e!r}")
+            estatisticas["falhas_leitura"] += 1
+            continue
+
+        estatisticas["linhas_com_eventos"] += len(itens)
+        if itens:
+            estatisticas["arquivos_com_eventos"] += 1
+        yield from itens
 
 
 def contar_arquivos_com_eventos(base_dir: Path) -> int:
-    arquivos = set()
-    for item in filtrar_eventos_sinistros(base_dir):
-        arquivos.add(item["arquivo"])
-    return len(arquivos)
+    estatisticas = novas_estatisticas()
+    for _ in filtrar_eventos_sinistros(base_dir, estatisticas):
+        pass
+    return estatisticas["arquivos_com_eventos"]
@@ -0,0 +1,153 @@
+import csv
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from pathlib import Path
+
+import requests
+
+from ans_dados.ans_source import gravar_json, ler_json, validadores
+
+
+URL_CADASTRO = (
+    "https://dadosabertos.ans.gov.br/FTP/PDA/operadoras_de_plano_de_saude_ativas/Relatorio_cadop.csv"
+)
+TTL_CADASTRO = 24 * 60 * 60
+
+VERSAO_INDICE = 1
+
+
+def so_digitos(s) -> str:
+    return "".join(ch for ch in str(s or "") if ch.isdigit())
+
+
+def atualizar_cadastro(cadastro_csv: Path, url: str = URL_CADASTRO, ttl: float = TTL_CADASTRO) -> bool:
+    # Revalida a cópia local com ETag/Last-Modified quando passou da validade.
+    # Devolve True se o arquivo foi baixado de novo.
+    meta_path = cadastro_csv.with_name(cadastro_csv.name + ".meta.json")
+    meta = ler_json(meta_path)
+    existe = cadastro_csv.exists()
+
+    if existe and time.time() - meta.get("verificado_em", 0) < ttl:
+        return False
+
+    headers = {}
+    if existe:
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    try:
+        resp = requests.get(url, headers=headers, timeout=60)
+        if resp.status_code == 304 and existe:
+            gravar_json(meta_path, {**meta, "verificado_em": time.time()})
+            return False
+        resp.raise_for_status()
+    except requests.RequestException as e:
+        if not existe:
+            raise
+        print(f"Não foi possível revalidar o cadastro, usando a cópia local: {e}")
+        return False
+
+    cadastro_csv.parent.mkdir(parents=True, exist_ok=True)
+    tmp = cadastro_csv.with_name(cadastro_csv.name + ".tmp")
+    tmp.write_bytes(resp.content)
+    os.replace(tmp, cadastro_csv)
+    gravar_json(meta_path, {**validadores(resp), "verificado_em": time.time()})
+    return True
+
+
+def assinatura_csv(cadastro_csv: Path) -> str:
+    st = cadastro_csv.stat()
+    return f"{VERSAO_INDICE}:{st.st_size}:{st.st_mtime_ns}"
+
+
+def indice_em_dia(indice: Path, assinatura: str) -> bool:
+    if not indice.exists():
+        return False
+    try:
+        with closing(sqlite3.connect(indice)) as conn:
+            linha = conn.execute("SELECT valor FROM meta WHERE chave = 'assinatura'").fetchone()
+    except sqlite3.Error:
+        return False
+    return linha is not None and linha[0] == assinatura
+
+
+def construir_indice(cadastro_csv: Path, indice: Path, assinatura: str) -> None:
+    tmp = indice.with_name(f"{indice.name}.{os.getpid()}.tmp")
+    tmp.unlink(missing_ok=True)
+
+    conn = sqlite3.connect(tmp)
+    try:
+        conn.execute("CREATE TABLE meta (chave TEXT PRIMARY KEY, valor TEXT)")
+        conn.execute(
+            "CREATE TABLE operadoras (ordem INTEGER PRIMARY KEY, registro TEXT, cnpj TEXT, dados TEXT NOT NULL)"
+        )
+
+        with cadastro_csv.open("r", encoding="utf-8", newline="") as f:
+            reader = csv.DictReader(f, delimiter=";")
+            linhas = (
+                (
+                    (row.get("REGISTRO_OPERADORA") or "").strip() or None,
+                    so_digitos(row.get("CNPJ")) or None,
+                    json.dumps({k: (v if v is not None else "") for k, v in row.items()}, ensure_ascii=False),
+                )
+                for row in reader
+            )
+            conn.executemany("INSERT INTO operadoras (registro, cnpj, dados) VALUES (?, ?, ?)", linhas)
+
+        conn.execute("CREATE INDEX ix_registro ON operadoras (registro, ordem)")
+        conn.execute("CREATE INDEX ix_cnpj ON operadoras (cnpj, ordem)")
+        conn.execute("INSERT INTO meta VALUES ('assinatura', ?)", (assinatura,))
+        conn.commit()
+    finally:
+        conn.close()
+
+    os.replace(tmp, indice)
+
+
+class RegistroOperadoras:
+    # Índice SQLite do Relatorio_cadop.csv, refeito só quando o CSV muda.
+    # Havendo registros ou CNPJs repetidos, vale a primeira linha do CSV.
+    def __init__(self, cadastro_csv: Path, indice: Path | None = None):
+        self.cadastro_csv = cadastro_csv
+        self.indice = indice or cadastro_csv.with_suffix(".sqlite")
+
+        assinatura = assinatura_csv(cadastro_csv)
+        if not indice_em_dia(self.indice, assinatura):
+            construir_indice(cadastro_csv, self.indice, assinatura)
+
+        self.conn = sqlite3.connect(self.indice.resolve().as_uri() + "?mode=ro", uri=True, check_same_thread=False)
+        self.lock = threading.Lock()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def buscar(self, coluna: str, valor: str) -> dict | None:
+        if not valor:
+            return None
+        with self.lock:
+            linha = self.conn.execute(
+                f"SELECT dados FROM operadoras WHERE {coluna} = ? ORDER BY ordem LIMIT 1", (valor,)
+            ).fetchone()
+        return json.loads(linha[0]) if linha else None
+
+    def por_registro(self, registro: str) -> dict | None:
+        return self.buscar("registro", str(registro or "").strip())
+
+    def por_cnpj(self, cnpj: str) -> dict | None:
+        return self.buscar("cnpj", so_digitos(cnpj))
+
+    def linhas(self) -> list[dict]:
+        with self.lock:
+            return [json.loads(d) for (d,) in self.conn.execute("SELECT dados FROM operadoras ORDER BY ordem")]
@@ -0,0 +1,64 @@
+import io
+import os
+import zipfile
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+
+
+# Método e nível de compressão das entradas dos zips de saída.
+COMPRESSOES = {
+    "armazenado": (zipfile.ZIP_STORED, None),
+    "rapido": (zipfile.ZIP_DEFLATED, 1),
+    "padrao": (zipfile.ZIP_DEFLATED, None),
+    "maximo": (zipfile.ZIP_DEFLATED, 9),
+    "bzip2": (zipfile.ZIP_BZIP2, 9),
+    "lzma": (zipfile.ZIP_LZMA, None),
+}
+
+
+class Tee:
+    def __init__(self, destinos: list):
+        self.destinos = destinos
+
+    def write(self, s: str) -> int:
+        for d in self.destinos:
+            d.write(s)
+        return len(s)
+
+
+def abrir_zip(zip_path: Path, compressao: str = "padrao") -> zipfile.ZipFile:
+    if compressao not in COMPRESSOES:
+        raise ValueError(f"Compressão desconhecida: {compressao}. Opções: {', '.join(COMPRESSOES)}")
+    metodo, nivel = COMPRESSOES[compressao]
+    return zipfile.ZipFile(zip_path, "w", compression=metodo, compresslevel=nivel)
+
+
+@contextmanager
+def csv_para_zip(zip_path: Path, nome: str, copia: Path | None = None, compressao: str = "padrao"):
+    # O texto vai direto para a entrada do zip (e, se pedido, para uma cópia
+    # em CSV), sem gravar e reler o arquivo inteiro antes de compactar.
+    tmp = zip_path.with_name(zip_path.name + ".tmp")
+    try:
+        with ExitStack() as pilha:
+            z = pilha.enter_context(abrir_zip(tmp, compressao))
+            entrada = pilha.enter_context(z.open(nome, "w", force_zip64=True))
+            destinos = [pilha.enter_context(io.TextIOWrapper(entrada, encoding="utf-8", newline=""))]
+            if copia is not None:
+                destinos.append(pilha.enter_context(copia.open("w", encoding="utf-8", newline="")))
+            yield Tee(destinos)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    os.replace(tmp, zip_path)
+
+
+@contextmanager
+def abrir_csv_saida(path: Path, zip_path: Path | None = None, compressao: str = "padrao"):
+    # Grava o CSV em path e, com zip_path, também como entrada do zip.
+    if zip_path is None:
+        with path.open("w", encoding="utf-8", newline="") as f:
+            yield f
+        return
+
+    with csv_para_zip(zip_path, path.name, copia=path, compressao=compressao) as f:
+        yield f
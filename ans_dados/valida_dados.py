@@ -1,7 +1,29 @@
 import csv
+import json
+import multiprocessing
 import re
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 from pathlib import Path
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from ans_dados.ans_source import gravar_json, ler_json
+from ans_dados.colunar import ESQUEMA_DESPESAS, SUFIXO, abrir_escrita, abrir_leitura, texto
+from ans_dados.numeros import parse_centavos
+
+
+CACHE_CNPJ = Path(".documentos/cache/cnpj.json")
+LIMITE_CACHE_CNPJ = 200_000
+TAMANHO_LOTE = 10_000
+
+PESOS_DV1 = [5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2]
+PESOS_DV2 = [6, 5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2]
+
 
 def so_digitos(s: str) -> str:
     return re.sub(r"\D+", "", s or "")
@@ -20,128 +42,268 @@ def cnpj_valido(cnpj_raw: str) -> bool:
         resto = soma % 11
         return "0" if resto < 2 else str(11 - resto)
 
-    pesos1 = [5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2]
-    pesos2 = [6, 5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2]
-
-    dv1 = calc_dv(cnpj[:12], pesos1)
-    dv2 = calc_dv(cnpj[:12] + dv1, pesos2)
+    dv1 = calc_dv(cnpj[:12], PESOS_DV1)
+    dv2 = calc_dv(cnpj[:12] + dv1, PESOS_DV2)
     return cnpj[-2:] == dv1 + dv2
 
 
-def parse_float(valor: str):
+def digitos_verificadores(m, pesos) -> "np.ndarray":
+    resto = (m[:, :len(pesos)] @ np.array(pesos, dtype=np.int64)) % 11
+    return np.where(resto < 2, 0, 11 - resto)
+
+
+def verificar_lote(cnpjs: list[str]) -> list[bool]:
+    # Recebe só dígitos. Com NumPy, os CNPJs de 14 dígitos ASCII viram uma
+    # matriz e os dois dígitos verificadores saem de um produto por pesos.
+    if np is None:
+        return [cnpj_valido(c) for c in cnpjs]
+
+    resultado = [False] * len(cnpjs)
+    idx = [i for i, c in enumerate(cnpjs) if len(c) == 14 and c.isascii()]
+    for i, c in enumerate(cnpjs):
+        if len(c) == 14 and not c.isascii():
+            resultado[i] = cnpj_valido(c)
+    if not idx:
+        return resultado
+
+    m = np.frombuffer("".join(cnpjs[i] for i in idx).encode("ascii"), dtype=np.uint8).reshape(-1, 14)
+    m = m.astype(np.int64) - 48
+
+    dv1 = digitos_verificadores(m, PESOS_DV1)
+    m12 = np.column_stack([m[:, :12], dv1])
+    dv2 = digitos_verificadores(m12, PESOS_DV2)
+
+    repetidos = (m == m[:, :1]).all(axis=1)
+    validos = (m[:, 12] == dv1) & (m[:, 13] == dv2) & ~repetidos
+
+    for i, v in zip(idx, validos.tolist()):
+        resultado[i] = v
+    return resultado
+
+
+class CacheCnpj:
+    # Resultado da validação por CNPJ (só dígitos), com limite de entradas:
+    # as usadas há mais tempo saem primeiro.
+    def __init__(self, path: Path | None = CACHE_CNPJ, limite: int = LIMITE_CACHE_CNPJ):
+        self.path = path
+        self.limite = limite
+        self.dados = OrderedDict(ler_json(path) if path else {})
+
+    def obter(self, cnpj: str) -> bool | None:
+        v = self.dados.get(cnpj)
+        if v is not None:
+            self.dados.move_to_end(cnpj)
+        return v
+
+    def guardar(self, cnpj: str, valido: bool) -> None:
+        self.dados[cnpj] = valido
+        self.dados.move_to_end(cnpj)
+        while len(self.dados) > self.limite:
+            self.dados.popitem(last=False)
+
+    def salvar(self) -> None:
+        if self.path is None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        gravar_json(self.path, dict(self.dados))
+
+
+def validar_cnpjs(cnpjs: list[str], cache: CacheCnpj | None = None) -> list[bool]:
+    # Valida em lote: cada valor distinto é normalizado e verificado uma vez.
+    digitos = {c: so_digitos(c) for c in set(cnpjs)}
+
+    resultado = {}
+    faltando = []
+    for d in set(digitos.values()):
+        v = cache.obter(d) if cache is not None else None
+        if v is None:
+            faltando.append(d)
+        else:
+            resultado[d] = v
+
+    for d, v in zip(faltando, verificar_lote(faltando)):
+        resultado[d] = v
+        if cache is not None:
+            cache.guardar(d, v)
+
+    return [resultado[digitos[c]] for c in cnpjs]
+
+
+def lotes(it, tamanho: int):
+    it = iter(it)
+    while lote := list(islice(it, tamanho)):
+        yield lote
+
+
+class Regra:
+    # modo "linha": verificar(row), sem estado, roda nos processos auxiliares;
+    # modo "lote": verificar(rows, cache), vetorizada sobre o lote inteiro;
+    # modo "sequencial": verificar(row, estado), vê as linhas na ordem do
+    # arquivo (regras entre linhas, como chave duplicada).
+    # verificar devolve None (ok) ou (código do erro, valor exibido).
+    def __init__(
+        self,
+        nome: str,
+        campo: str,
+        verificar,
+        modo: str = "linha",
+        status: str | None = None,
+        campos: list[str] = (),
+    ):
+        self.nome = nome
+        self.campo = campo
+        self.verificar = verificar
+        self.modo = modo
+        self.status = status
+        self.campos = list(campos) or [campo]
+
+
+def regra_valor(row: dict):
+    valor_raw = row.get("ValorDespesas")
+    valor = parse_centavos(valor_raw)
     if valor is None:
-        return None
-    v = str(valor).strip()
-    if not v:
-        return None
+        return "VALOR_NAO_NUMERICO", texto(valor_raw)
+    if valor <= 0:
+        return "VALOR_NAO_POSITIVO", texto(valor_raw)
+    return None
+
 
-    if "," in v and "." in v and v.rfind(",") > v.rfind("."):
-        v = v.replace(".", "").replace(",", ".")
-    else:
-        v = v.replace(",", ".")
+def regra_razao_social(row: dict):
+    razao = (row.get("RazaoSocial") or "").strip()
+    return None if razao else ("RAZAO_SOCIAL_VAZIA", razao)
 
-    try:
-        return float(v)
-    except ValueError:
+
+def regra_cnpj(linhas: list[dict], cache: CacheCnpj | None):
+    cnpjs = [(row.get("CNPJ") or "").strip() for row in linhas]
+    return [None if ok else ("CNPJ_INVALIDO", c) for c, ok in zip(cnpjs, validar_cnpjs(cnpjs, cache))]
+
+
+def regra_chave_duplicada(row: dict, estado: dict):
+    reg = str(row.get("RegistroANS") or "").strip()
+    if not reg:
         return None
+    chave = (reg, str(row.get("Ano") or "").strip(), str(row.get("Trimestre") or "").strip())
+    vistos = estado.setdefault("vistos", set())
+    if chave in vistos:
+        return "CHAVE_DUPLICADA", "/".join(chave)
+    vistos.add(chave)
+    return None
+
+
+# Ordem da lista = ordem das colunas de status e dos erros de cada linha.
+REGRAS = [
+    Regra("valor", "ValorDespesas", regra_valor, status="StatusValor"),
+    Regra("razao_social", "RazaoSocial", regra_razao_social, status="StatusRazaoSocial"),
+    Regra("cnpj", "CNPJ", regra_cnpj, modo="lote", status="StatusCNPJ"),
+    Regra(
+        "chave_duplicada",
+        "RegistroANS",
+        regra_chave_duplicada,
+        modo="sequencial",
+        campos=["RegistroANS", "Ano", "Trimestre"],
+    ),
+]
+
 
+def compilar_regras(campos: list[str], regras: list[Regra] = REGRAS) -> list[Regra]:
+    # Só entram as regras cujas colunas existem no arquivo.
+    return [r for r in regras if all(c in campos for c in r.campos)]
 
-def validar_dados(consolidado_csv: Path, out_dir: Path) -> None:
+
+def verificar_linhas(verificacoes: tuple, linhas: list[dict]) -> dict[str, list]:
+    # verificacoes: pares (nome, verificar) do plano compilado.
+    return {nome: [verificar(row) for row in linhas] for nome, verificar in verificacoes}
+
+
+def lotes_verificados(lotes_, verificacoes: tuple, campos: list[str], jobs: int):
+    # Devolve (lote, resultado das regras "linha") na ordem dos lotes. Com
+    # jobs > 1 os lotes vão para um pool de processos, com no máximo 2 * jobs
+    # lotes em andamento para não carregar o arquivo inteiro na memória; as
+    # funções das regras vão junto, então precisam ser de nível de módulo.
+    if jobs <= 1 or not verificacoes:
+        for lote in lotes_:
+            yield lote, verificar_linhas(verificacoes, [row for _, row in lote])
+        return
+
+    # spawn: o pipeline roda etapas em threads, e fork com threads ativas
+    # pode herdar locks presos.
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context("spawn")) as pool:
+        pendentes = deque()
+        for lote in lotes_:
+            projetadas = [{c: row.get(c) for c in campos} for _, row in lote]
+            pendentes.append((lote, pool.submit(verificar_linhas, verificacoes, projetadas)))
+            if len(pendentes) >= 2 * jobs:
+                lote_pronto, fut = pendentes.popleft()
+                yield lote_pronto, fut.result()
+        while pendentes:
+            lote_pronto, fut = pendentes.popleft()
+            yield lote_pronto, fut.result()
+
+
+def validar_dados(
+    consolidado_csv: Path,
+    out_dir: Path,
+    formato: str = "csv",
+    cache_cnpj: Path | None = CACHE_CNPJ,
+    jobs: int = 1,
+    regras: list[Regra] = REGRAS,
+) -> None:
     out_dir.mkdir(parents=True, exist_ok=True)
+    cache = CacheCnpj(cache_cnpj)
 
-    validado_csv = out_dir / "consolidado_validado.csv"
+    # O validado pode sair no formato colunar; os erros são sempre CSV.
+    validado_csv = out_dir / ("consolidado_validado" + (SUFIXO if formato == "colunar" else ".csv"))
     erros_csv = out_dir / "erros_validacao.csv"
 
-    with consolidado_csv.open("r", encoding="utf-8", newline="") as f:
-        reader = csv.DictReader(f)
-        fieldnames = reader.fieldnames or []
-
+    with abrir_leitura(consolidado_csv) as (fieldnames, reader):
         campos = {"RegistroANS", "RazaoSocial", "Trimestre", "Ano", "ValorDespesas"}
-        if not reader.fieldnames or not campos.issubset(reader.fieldnames):
+        if not fieldnames or not campos.issubset(fieldnames):
             raise ValueError(f"CSV inválido, colunas esperadas: {campos}")
-        
-        tem_cnpj = "CNPJ" in fieldnames
 
-        campos_saida = fieldnames + [
-            "StatusValor",
-            "StatusRazaoSocial",
-        ]
-        if tem_cnpj:
-            campos_saida.append("StatusCNPJ")
+        plano = compilar_regras(fieldnames, regras)
+        por_linha = tuple((r.nome, r.verificar) for r in plano if r.modo == "linha")
+        campos_linha = sorted({c for r in plano if r.modo == "linha" for c in r.campos})
+        estados = {r.nome: {} for r in plano if r.modo == "sequencial"}
+        contadores = {r.nome: {"verificadas": 0, "erros": {}} for r in plano}
+
+        campos_saida = fieldnames + [r.status for r in plano if r.status]
 
-        with validado_csv.open("w", encoding="utf-8", newline="") as fv, erros_csv.open(
+        with abrir_escrita(validado_csv, campos_saida, ESQUEMA_DESPESAS) as w_valid, erros_csv.open(
             "w", encoding="utf-8", newline=""
         ) as fe:
 
-            w_valid = csv.DictWriter(fv, fieldnames=campos_saida)
-            w_valid.writeheader()
-
             w_err = csv.DictWriter(
                 fe,
                 fieldnames=["Linha", "Campo", "Erro", "Valor"],
             )
             w_err.writeheader()
 
-            for linha, row in enumerate(reader, start=2):
-                razao = (row.get("RazaoSocial") or "").strip()
-                valor_raw = row.get("ValorDespesas")
-
-                valor = parse_float(valor_raw)
-                if valor is None:
-                    row["StatusValor"] = "INVALIDO"
-                    w_err.writerow(
-                        {
-                            "Linha": linha,
-                            "Campo": "ValorDespesas",
-                            "Erro": "VALOR_NAO_NUMERICO",
-                            "Valor": valor_raw,
-                        }
-                    )
-                elif valor <= 0:
-                    row["StatusValor"] = "INVALIDO"
-                    w_err.writerow(
-                        {
-                            "Linha": linha,
-                            "Campo": "ValorDespesas",
-                            "Erro": "VALOR_NAO_POSITIVO",
-                            "Valor": valor_raw,
-                        }
-                    )
-                else:
-                    row["StatusValor"] = "OK"
-
-
-                if razao:
-                    row["StatusRazaoSocial"] = "OK"
-                else:
-                    row["StatusRazaoSocial"] = "INVALIDO"
-                    w_err.writerow(
-                        {
-                            "Linha": linha,
-                            "Campo": "RazaoSocial",
-                            "Erro": "RAZAO_SOCIAL_VAZIA",
-                            "Valor": razao,
-                        }
-                    )
-                
-
-                if tem_cnpj:
-                    cnpj = (row.get("CNPJ") or "").strip()
-                    if cnpj_valido(cnpj):
-                        row["StatusCNPJ"] = "OK"
-                    else:
-                        row["StatusCNPJ"] = "INVALIDO"
-                        w_err.writerow(
-                            {
-                                "Linha": linha,
-                                "Campo": "CNPJ",
-                                "Erro": "CNPJ_INVALIDO",
-                                "Valor": cnpj,
-                            }
-                        )
-
-                w_valid.writerow(row)
+            lotes_ = lotes(enumerate(reader, start=2), TAMANHO_LOTE)
+            for lote, resultado in lotes_verificados(lotes_, por_linha, campos_linha, jobs):
+                linhas = [row for _, row in lote]
+                for r in plano:
+                    if r.modo == "lote":
+                        resultado[r.nome] = r.verificar(linhas, cache)
+                    elif r.modo == "sequencial":
+                        resultado[r.nome] = [r.verificar(row, estados[r.nome]) for row in linhas]
+
+                for j, (linha, row) in enumerate(lote):
+                    for r in plano:
+                        falha = resultado[r.nome][j]
+                        contador = contadores[r.nome]
+                        contador["verificadas"] += 1
+
+                        if r.status:
+                            row[r.status] = "INVALIDO" if falha else "OK"
+                        if falha:
+                            erro, valor = falha
+                            contador["erros"][erro] = contador["erros"].get(erro, 0) + 1
+                            w_err.writerow({"Linha": linha, "Campo": r.campo, "Erro": erro, "Valor": valor})
+
+                    w_valid.writerow(row)
 
+    cache.salvar()
+    (out_dir / "regras_validacao.json").write_text(json.dumps(contadores, indent=2), encoding="utf-8")
     print("Validação concluída!")
 
 if __name__ == "__main__":
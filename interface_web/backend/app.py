@@ -1,8 +1,34 @@
 from flask import Flask, jsonify, request
 from flask_cors import CORS
+import argparse
 import csv
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from array import array
 from pathlib import Path
 from collections import defaultdict
+import heapq
+
+# O cadastro de operadoras vem do mesmo índice usado pelo pacote ans_dados.
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+from ans_dados.colunar import SUFIXO, EscritorColunar, TabelaColunar
+from ans_dados.numeros import parse_centavos
+from ans_dados.registro_operadoras import RegistroOperadoras
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: sem flock, a trava usa msvcrt.locking.
+    fcntl = None
+    import msvcrt
 
 app = Flask(__name__)
 CORS(app)
@@ -11,8 +37,56 @@ BASE_DIR = Path(__file__).parent
 DATA_DIR = BASE_DIR / "data"
 
 OPERADORAS_CSV = DATA_DIR / "relatorio_cadop.csv"
+OPERADORAS_INDICE = DATA_DIR / "relatorio_cadop.sqlite"
 DESPESAS_CSV = DATA_DIR / "consolidado_despesas.csv"
 
+# Dados já lidos, normalizados e indexados, para subir sem reler os CSVs.
+# As linhas, com os campos normalizados, ficam nos mesmos arquivos colunares
+# do modo "colunar"; este arquivo guarda só os índices e as estatísticas:
+#   b"ANSAPI01" | uint64 tamanho do cabeçalho | cabeçalho JSON | blocos
+# O cabeçalho traz a versão do formato, o sha256 dos CSVs de origem, as
+# estatísticas e, para cada índice, as chaves e a posição de dois blocos:
+# início de cada lista (uint64) e as posições concatenadas (uint32). As
+# listas são lidas direto do mmap e nada do arquivo é executado (ele fica num
+# volume montado). Se um hash não bater, os CSVs são lidos de novo.
+FAST_START_PATH = DATA_DIR / "backend_fast_start.bin"
+FAST_START_MAGICO = b"ANSAPI01"
+FAST_START_VERSAO = 3
+FAST_START_INDICES = ("busca_nome", "busca_digitos", "historico")
+
+# "memoria": cada processo guarda as linhas como dicts (e usa o fast-start).
+# "colunar": as tabelas ficam em arquivos colunares (ans_dados.colunar)
+# abertos com mmap; vários workers compartilham as mesmas páginas do cache
+# do sistema e só as linhas de cada resposta viram dicts.
+ARMAZENAMENTO = os.environ.get("ARMAZENAMENTO", "memoria")
+OPERADORAS_COLUNAR = DATA_DIR / f"operadoras{SUFIXO}"
+DESPESAS_COLUNAR = DATA_DIR / f"despesas{SUFIXO}"
+COLUNAR_VERSAO = 1
+# Trava entre processos para gerar os arquivos derivados uma vez só.
+CARGA_LOCK = DATA_DIR / ".carga.lock"
+
+# Intervalo (s) entre as verificações de mudança nos arquivos de dados.
+RELOAD_INTERVAL = float(os.environ.get("RELOAD_INTERVAL", "5"))
+
+CHAVES_INTERNAS_OPERADORAS = {"_registro_norm", "_cnpj_norm", "_razao_norm"}
+CHAVES_INTERNAS_DESPESAS = {"_registro_norm", "_valor_centavos", "_ano_num", "_tri_num"}
+ESQUEMA_DESPESAS = {"_valor_centavos": "i8", "_ano_num": "i8", "_tri_num": "i8"}
+
+COLUNAS_OPERADORAS = {
+    "col_registro": "REGISTRO_OPERADORA",
+    "col_cnpj": "CNPJ",
+    "col_razao": "Razao_Social",
+    "col_uf": "UF",
+    "col_modalidade": "Modalidade",
+}
+COLUNAS_DESPESAS = {
+    "col_registro": "RegistroANS",
+    "col_razao": "RazaoSocial",
+    "col_ano": "Ano",
+    "col_tri": "Trimestre",
+    "col_valor": "ValorDespesas",
+}
+
 
 def only_digits(s: str) -> str:
     return "".join(ch for ch in str(s) if ch.isdigit())
@@ -21,23 +95,9 @@ def to_int_digits(value) -> int:
     s = only_digits(value)
     return int(s) if s else 0
 
-def to_float_br(value) -> float:
-    if value is None:
-        return 0.0
-
-    s = str(value).strip()
-    if not s:
-        return 0.0
-
-    if "," in s and "." in s:
-        s = s.replace(".", "").replace(",", ".")
-    elif "," in s:
-        s = s.replace(",", ".")
-
-    try:
-        return float(s)
-    except ValueError:
-        return 0.0
+def to_centavos(value) -> int:
+    centavos = parse_centavos(value)
+    return centavos if centavos is not None else 0
 
 
 def read_csv_dicts(path: Path, delimiter: str = ",", encoding: str = "utf-8"):
@@ -52,61 +112,112 @@ def read_csv_dicts(path: Path, delimiter: str = ",", encoding: str = "utf-8"):
         return rows
 
 
-_CACHE = {"operadoras": None, "despesas": None}
+def trigrams(s: str) -> set[str]:
+    return {s[i:i + 3] for i in range(len(s) - 2)}
 
 
-def find_operadora(cnpj_or_registro: str):
-    op = load_operadoras()
+def build_trigram_index(textos) -> dict[str, array]:
+    # trigrama -> posições (em ordem crescente) das linhas que o contêm em algum campo
+    index = defaultdict(lambda: array("I"))
+    for pos, campos in enumerate(textos):
+        tris = set()
+        for campo in campos:
+            tris |= trigrams(campo)
+        for t in tris:
+            index[t].append(pos)
+    return dict(index)
+
+
+def search_trigrams(index: dict[str, array], textos, q: str) -> list[int]:
+    # A interseção das listas dá os candidatos; a confirmação é o mesmo teste
+    # de substring da busca linear. Consultas com menos de 3 caracteres varrem tudo.
+    if len(q) < 3:
+        candidatos = range(len(textos))
+    else:
+        listas = sorted((index.get(t, ()) for t in trigrams(q)), key=len)
+        cand = set(listas[0])
+        for posicoes in listas[1:]:
+            if not cand:
+                break
+            cand.intersection_update(posicoes)
+        candidatos = sorted(cand)
+    return [i for i in candidatos if any(q in campo for campo in textos[i])]
+
+
+def find_operadora(op: dict, cnpj_or_registro: str):
     key_digits = only_digits(cnpj_or_registro)
 
     if len(key_digits) >= 11:
-        found = op["by_cnpj"].get(key_digits)
+        found = op["registro"].por_cnpj(key_digits)
         if found:
             return found
 
-    found = op["by_registro"].get(key_digits)
-    return found
+    return op["registro"].por_registro(key_digits)
+
+
+class ColunarRows:
+    # Sequência sobre uma TabelaColunar: cada linha vira dict só quando acessada.
+    def __init__(self, tabela: TabelaColunar, campos: list[str]):
+        self.tabela = tabela
+        self.campos = campos
+
+    def __len__(self) -> int:
+        return self.tabela.n
 
+    def __getitem__(self, i: int) -> dict:
+        return {c: self.tabela.valor(c, i) for c in self.campos}
 
-def load_operadoras():
 
-    if _CACHE["operadoras"] is not None:
-        return _CACHE["operadoras"]
+def read_operadoras() -> tuple[RegistroOperadoras, list[dict]]:
 
-    rows = read_csv_dicts(OPERADORAS_CSV, delimiter=";")
+    if not OPERADORAS_CSV.exists():
+        raise FileNotFoundError(f"Arquivo não encontrado: {OPERADORAS_CSV}")
+
+    registro = RegistroOperadoras(OPERADORAS_CSV, OPERADORAS_INDICE)
+    rows = registro.linhas()
 
     for r in rows:
         r["_registro_norm"] = (r.get("REGISTRO_OPERADORA", "") or "").strip()
         r["_cnpj_norm"] = only_digits(r.get("CNPJ", ""))
         r["_razao_norm"] = (r.get("Razao_Social", "") or "").strip().lower()
-    
-    by_cnpj = {}
-    by_registro = {}
-    for r in rows:
-        if r["_cnpj_norm"]:
-            by_cnpj[r["_cnpj_norm"]] = r
-        if r["_registro_norm"]:
-            by_registro[r["_registro_norm"]] = r
+
+    return registro, rows
+
+
+def load_operadoras(registro: RegistroOperadoras | None = None, rows: list[dict] | None = None, indices: dict | None = None):
+    # Sem argumentos lê o CSV e monta os índices; o fast-start passa as
+    # linhas e os índices já prontos.
+    if rows is None:
+        registro, rows = read_operadoras()
+
+    textos_nome = [[r["_razao_norm"]] for r in rows]
+    textos_digitos = [[r["_cnpj_norm"], r["_registro_norm"]] for r in rows]
 
     data = {
         "rows": rows,
-        "col_registro": "REGISTRO_OPERADORA",
-        "col_cnpj": "CNPJ",
-        "col_razao": "Razao_Social",
-        "col_uf": "UF",
-        "col_modalidade": "Modalidade",
-        "by_cnpj": by_cnpj,
-        "by_registro": by_registro,
-
+        **COLUNAS_OPERADORAS,
+        "registro": registro,
+        "busca_nome": (indices["busca_nome"] if indices else build_trigram_index(textos_nome), textos_nome),
+        "busca_digitos": (indices["busca_digitos"] if indices else build_trigram_index(textos_digitos), textos_digitos),
     }
-    _CACHE["operadoras"] = data
     return data
 
 
-def load_despesas():
+def build_historico(registros: list[str], anos: list[int], tris: list[int]) -> dict[str, array]:
+    # Posições das linhas de cada registro já ordenadas por (ano, trimestre),
+    # prontas para a resposta de /despesas.
+    por_registro = defaultdict(list)
+    for pos, registro in enumerate(registros):
+        por_registro[registro].append(pos)
+
+    historico = {}
+    for registro, posicoes in por_registro.items():
+        posicoes.sort(key=lambda i: (anos[i], tris[i]))
+        historico[registro] = array("I", posicoes)
+    return historico
 
-    if _CACHE["despesas"] is not None:
-        return _CACHE["despesas"]
+
+def read_despesas() -> list[dict]:
 
     rows = read_csv_dicts(DESPESAS_CSV, delimiter=",")
 
@@ -119,31 +230,480 @@ def load_despesas():
 
     for r in rows:
         r["_registro_norm"] = (r.get("RegistroANS", "") or "").strip()
-        r["_valor_num"] = to_float_br(r.get("ValorDespesas", ""))
+        r["_valor_centavos"] = to_centavos(r.get("ValorDespesas", ""))
         r["_ano_num"] = to_int_digits(r.get("Ano"))
         r["_tri_num"] = to_int_digits(r.get("Trimestre"))
 
+    return rows
+
+
+def load_despesas(rows: list[dict] | None = None, historico: dict | None = None):
+    if rows is None:
+        rows = read_despesas()
+    if historico is None:
+        historico = build_historico(
+            [r["_registro_norm"] for r in rows],
+            [r["_ano_num"] for r in rows],
+            [r["_tri_num"] for r in rows],
+        )
 
     data = {
         "rows": rows,
-        "col_registro": "RegistroANS",
-        "col_razao": "RazaoSocial",
-        "col_ano": "Ano",
-        "col_tri": "Trimestre",
-        "col_valor": "ValorDespesas",
+        "publicas": [{k: v for k, v in r.items() if k not in CHAVES_INTERNAS_DESPESAS} for r in rows],
+        "historico": historico,
+        **COLUNAS_DESPESAS,
     }
-    _CACHE["despesas"] = data
     return data
 
 
+def open_colunar(path: Path, fonte: str | None) -> TabelaColunar | None:
+    # Só vale se foi gerado da mesma versão do CSV de origem.
+    if not path.exists():
+        return None
+    try:
+        tabela = TabelaColunar(path)
+    except (OSError, ValueError):
+        return None
+    if tabela.meta != {"versao": COLUNAR_VERSAO, "fonte": fonte}:
+        tabela.close()
+        return None
+    return tabela
+
+
+def write_colunar(path: Path, rows: list[dict], campos: list[str], esquema: dict[str, str], fonte: str) -> None:
+    w = EscritorColunar(
+        path,
+        {c: esquema.get(c, "str") for c in campos},
+        {"versao": COLUNAR_VERSAO, "fonte": fonte},
+    )
+    w.writerows(rows)
+    w.fechar()
+
+
+@contextmanager
+def data_lock():
+    # flock exclusivo: workers que sobem (ou recarregam) juntos esperam o
+    # primeiro gerar os arquivos, em vez de cada um regravar e trocar o
+    # arquivo que os outros acabaram de mapear.
+    try:
+        f = CARGA_LOCK.open("a")
+    except OSError:
+        # Pasta só de leitura: nenhum processo vai gravar nada ali.
+        yield
+        return
+    with f:
+        travar(f)
+        try:
+            yield
+        finally:
+            destravar(f)
+
+
+def travar(f) -> None:
+    if fcntl is not None:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        return
+    # msvcrt trava um intervalo de bytes (aqui o primeiro) e, com LK_LOCK,
+    # desiste depois de ~10 s; tenta de novo até conseguir, como o flock.
+    f.seek(0)
+    while True:
+        try:
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            return
+        except OSError:
+            pass
+
+
+def destravar(f) -> None:
+    if fcntl is not None:
+        fcntl.flock(f, fcntl.LOCK_UN)
+        return
+    f.seek(0)
+    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def campos_operadoras(rows: list[dict]) -> list[str]:
+    return list(rows[0]) if rows else ["REGISTRO_OPERADORA", "CNPJ", "Razao_Social", *CHAVES_INTERNAS_OPERADORAS]
+
+
+def load_colunar(hashes: dict) -> tuple[dict, dict]:
+    # O primeiro processo que encontra os arquivos colunares desatualizados
+    # os regrava a partir dos CSVs; os demais só abrem e indexam.
+    for nome, fonte in hashes.items():
+        if fonte is None:
+            raise FileNotFoundError(f"Arquivo não encontrado: {DATA_DIR / nome}")
+
+    fonte_op = hashes[OPERADORAS_CSV.name]
+    fonte_desp = hashes[DESPESAS_CSV.name]
+    tab_op = open_colunar(OPERADORAS_COLUNAR, fonte_op)
+    tab_desp = open_colunar(DESPESAS_COLUNAR, fonte_desp)
+    registro = None
+    if tab_op is None or tab_desp is None:
+        with data_lock():
+            # Outro worker pode ter gerado enquanto este esperava a trava.
+            # O índice SQLite do cadastro, que muda junto com o CSV, também é
+            # refeito aqui dentro.
+            if tab_op is None:
+                tab_op = open_colunar(OPERADORAS_COLUNAR, fonte_op)
+            if tab_op is None:
+                registro, rows = read_operadoras()
+                write_colunar(OPERADORAS_COLUNAR, rows, campos_operadoras(rows), {}, fonte_op)
+                del rows
+                tab_op = open_colunar(OPERADORAS_COLUNAR, fonte_op)
+
+            if tab_desp is None:
+                tab_desp = open_colunar(DESPESAS_COLUNAR, fonte_desp)
+            if tab_desp is None:
+                rows = read_despesas()
+                write_colunar(DESPESAS_COLUNAR, rows, list(rows[0]), ESQUEMA_DESPESAS, fonte_desp)
+                del rows
+                tab_desp = open_colunar(DESPESAS_COLUNAR, fonte_desp)
+
+            if registro is None:
+                registro = RegistroOperadoras(OPERADORAS_CSV, OPERADORAS_INDICE)
+    else:
+        registro = RegistroOperadoras(OPERADORAS_CSV, OPERADORAS_INDICE)
+
+    # Só os campos normalizados da busca ficam em memória em cada processo
+    # (a confirmação por substring precisa deles a cada tecla digitada).
+    textos_nome = [[n] for n in tab_op.valores("_razao_norm")]
+    textos_digitos = [list(t) for t in zip(tab_op.valores("_cnpj_norm"), tab_op.valores("_registro_norm"))]
+
+    publicas_op = [c for c in tab_op.nomes if c not in CHAVES_INTERNAS_OPERADORAS]
+    op = {
+        "rows": ColunarRows(tab_op, publicas_op),
+        **COLUNAS_OPERADORAS,
+        "registro": registro,
+        "busca_nome": (build_trigram_index(textos_nome), textos_nome),
+        "busca_digitos": (build_trigram_index(textos_digitos), textos_digitos),
+    }
+
+    publicas_desp = [c for c in tab_desp.nomes if c not in CHAVES_INTERNAS_DESPESAS]
+    desp = {
+        "rows": ColunarRows(tab_desp, tab_desp.nomes),
+        "tabela": tab_desp,
+        "publicas": ColunarRows(tab_desp, publicas_desp),
+        "historico": build_historico(
+            tab_desp.valores("_registro_norm"), tab_desp.valores("_ano_num"), tab_desp.valores("_tri_num")
+        ),
+        **COLUNAS_DESPESAS,
+    }
+    return op, desp
+
+
+# Snapshot = operadoras + despesas + estatísticas de uma mesma carga. Uma
+# thread refaz tudo fora das requisições quando tamanho ou mtime dos CSVs
+# mudam e só então troca a referência; requisições em andamento terminam no
+# snapshot antigo (a conexão SQLite dele fecha quando ninguém mais o usa).
+_LOADER = {
+    "snapshot": None,
+    "versao": 0,
+    "verificado_em": None,
+    "erro": None,
+    "assinatura_falha": None,
+    "thread": None,
+}
+_LOADER_LOCK = threading.Lock()
+
+
+def agora() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+
+def data_signature() -> dict:
+    assinatura = {}
+    for path in (OPERADORAS_CSV, DESPESAS_CSV):
+        try:
+            st = path.stat()
+            assinatura[path.name] = {"tamanho": st.st_size, "mtime_ns": st.st_mtime_ns}
+        except FileNotFoundError:
+            assinatura[path.name] = None
+    return assinatura
+
+
+def source_hashes() -> dict:
+    hashes = {}
+    for path in (OPERADORAS_CSV, DESPESAS_CSV):
+        if not path.exists():
+            hashes[path.name] = None
+            continue
+        h = hashlib.sha256()
+        with path.open("rb") as f:
+            while bloco := f.read(1 << 20):
+                h.update(bloco)
+        hashes[path.name] = h.hexdigest()
+    return hashes
+
+
+def save_fast_start(path: Path, hashes: dict, op: dict, desp: dict, est: dict) -> None:
+    # Chamado com a trava de carga. As tabelas colunares só são regravadas
+    # se não forem destes CSVs (o modo "colunar" pode já tê-las gerado).
+    for tabela_path, rows, campos, esquema, fonte in (
+        (OPERADORAS_COLUNAR, op["rows"], campos_operadoras(op["rows"]), {}, hashes[OPERADORAS_CSV.name]),
+        (DESPESAS_COLUNAR, desp["rows"], list(desp["rows"][0]), ESQUEMA_DESPESAS, hashes[DESPESAS_CSV.name]),
+    ):
+        tabela = open_colunar(tabela_path, fonte)
+        if tabela is None:
+            write_colunar(tabela_path, rows, campos, esquema, fonte)
+        else:
+            tabela.close()
+
+    blocos = []
+    pos = 0
+
+    def bloco(dados: bytes) -> list[int]:
+        nonlocal pos
+        inicio = pos
+        blocos.append(dados)
+        pos += len(dados)
+        pad = -pos % 8
+        if pad:
+            blocos.append(b"\0" * pad)
+            pos += pad
+        return [inicio, len(dados)]
+
+    indices = {}
+    for nome, index in zip(FAST_START_INDICES, (op["busca_nome"][0], op["busca_digitos"][0], desp["historico"])):
+        chaves = list(index)
+        inicios = array("Q", [0])
+        for chave in chaves:
+            inicios.append(inicios[-1] + len(index[chave]))
+        indices[nome] = {
+            "chaves": chaves,
+            "inicios": bloco(inicios.tobytes()),
+            "posicoes": bloco(b"".join(index[chave].tobytes() for chave in chaves)),
+        }
+
+    cabecalho = json.dumps(
+        {"versao": FAST_START_VERSAO, "fontes": hashes, "estatisticas": est, "indices": indices}
+    ).encode("utf-8")
+    cabecalho += b" " * (-(len(FAST_START_MAGICO) + 8 + len(cabecalho)) % 8)
+
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with tmp.open("wb") as f:
+        f.write(FAST_START_MAGICO)
+        f.write(struct.pack("<Q", len(cabecalho)))
+        f.write(cabecalho)
+        for b in blocos:
+            f.write(b)
+    os.replace(tmp, path)
+
+
+def load_fast_start(path: Path, hashes: dict):
+    # Devolve (op, desp, est) ou None se o arquivo (ou uma das tabelas
+    # colunares) não existe, é de outra versão ou veio de outros CSVs.
+    if not path.exists() or None in hashes.values():
+        return None
+
+    with path.open("rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    inicio = len(FAST_START_MAGICO) + 8
+    if len(mm) < inicio or mm[:len(FAST_START_MAGICO)] != FAST_START_MAGICO:
+        mm.close()
+        return None
+    (tam,) = struct.unpack_from("<Q", mm, len(FAST_START_MAGICO))
+    try:
+        cabecalho = json.loads(bytes(mm[inicio:inicio + tam]))
+    except ValueError:
+        mm.close()
+        return None
+    if cabecalho.get("versao") != FAST_START_VERSAO or cabecalho.get("fontes") != hashes:
+        mm.close()
+        return None
+
+    tab_op = open_colunar(OPERADORAS_COLUNAR, hashes[OPERADORAS_CSV.name])
+    tab_desp = open_colunar(DESPESAS_COLUNAR, hashes[DESPESAS_CSV.name])
+    if tab_op is None or tab_desp is None:
+        for tabela in (tab_op, tab_desp):
+            if tabela is not None:
+                tabela.close()
+        mm.close()
+        return None
+    with tab_op, tab_desp:
+        rows_op = list(tab_op.linhas())
+        rows_desp = list(tab_desp.linhas())
+
+    # Cada lista de posições é uma fatia do mmap (memoryview "I"), sem cópia;
+    # o mmap fica aberto enquanto o snapshot usar os índices.
+    base = memoryview(mm)[inicio + tam:]
+    indices = {}
+    for nome in FAST_START_INDICES:
+        d = cabecalho["indices"][nome]
+        a, n = d["inicios"]
+        inicios = base[a:a + n].cast("Q").tolist()
+        a, n = d["posicoes"]
+        posicoes = base[a:a + n].cast("I")
+        indices[nome] = {chave: posicoes[inicios[k]:inicios[k + 1]] for k, chave in enumerate(d["chaves"])}
+
+    est = cabecalho["estatisticas"]
+    est["parciais"] = tuple(
+        (tuple(chave), {**p, "nomes": {nome: tuple(v) for nome, v in p["nomes"].items()}})
+        for chave, p in est["parciais"]
+    )
+
+    registro = RegistroOperadoras(OPERADORAS_CSV, OPERADORAS_INDICE)
+    op = load_operadoras(registro, rows_op, indices)
+    desp = load_despesas(rows_desp, indices["historico"])
+    return op, desp, est
+
+
+def parse_sources(hashes: dict) -> tuple[dict, dict, dict]:
+    op = load_operadoras()
+    desp = load_despesas()
+    est = build_estatisticas(op, desp)
+    try:
+        save_fast_start(FAST_START_PATH, hashes, op, desp, est)
+    except OSError as e:
+        print(f"Não foi possível gravar {FAST_START_PATH.name}: {e}")
+    return op, desp, est
+
+
+def load_sources(hashes: dict) -> tuple[str, tuple[dict, dict, dict]]:
+    if ARMAZENAMENTO == "colunar":
+        op, desp = load_colunar(hashes)
+        return "colunar", (op, desp, build_estatisticas(op, desp))
+
+    carregado = load_fast_start(FAST_START_PATH, hashes)
+    if carregado is None:
+        with data_lock():
+            # Outro worker pode ter gerado enquanto este esperava a trava.
+            carregado = load_fast_start(FAST_START_PATH, hashes)
+            if carregado is None:
+                return "csv", parse_sources(hashes)
+    return "fast_start", carregado
+
+
+def build_snapshot(versao: int) -> dict:
+    inicio = time.perf_counter()
+    assinatura = data_signature()
+
+    origem, (op, desp, est) = load_sources(source_hashes())
+
+    # Arquivo ainda sendo copiado: descarta e tenta de novo na próxima verificação.
+    if data_signature() != assinatura:
+        raise RuntimeError("Arquivos de dados alterados durante a carga")
+
+    return {
+        "versao": versao,
+        "operadoras": op,
+        "despesas": desp,
+        "estatisticas": est,
+        "assinatura": assinatura,
+        "origem": origem,
+        "carregado_em": agora(),
+        "duracao_s": round(time.perf_counter() - inicio, 3),
+    }
+
+
+def reload_snapshot(force: bool = False) -> bool:
+    # Devolve True se um snapshot novo foi publicado.
+    with _LOADER_LOCK:
+        assinatura = data_signature()
+        _LOADER["verificado_em"] = agora()
+        atual = _LOADER["snapshot"]
+        if not force:
+            if atual is not None and atual["assinatura"] == assinatura:
+                return False
+            if _LOADER["assinatura_falha"] == assinatura:
+                return False
+
+        try:
+            novo = build_snapshot(_LOADER["versao"] + 1)
+        except Exception as e:
+            _LOADER["erro"] = f"{type(e).__name__}: {e}"
+            _LOADER["assinatura_falha"] = assinatura
+            raise
+
+        _LOADER["versao"] = novo["versao"]
+        _LOADER["erro"] = None
+        _LOADER["assinatura_falha"] = None
+        _LOADER["snapshot"] = novo
+        return True
+
+
+def watch_data_files(intervalo: float) -> None:
+    while True:
+        time.sleep(intervalo)
+        try:
+            if reload_snapshot():
+                print(f"Dados recarregados (versão {_LOADER['versao']})")
+        except Exception as e:
+            print(f"Falha ao recarregar os dados, mantendo a versão {_LOADER['versao']}: {e}")
+
+
+def start_loader(intervalo: float = RELOAD_INTERVAL) -> None:
+    # Primeira carga já na subida do processo, depois a verificação periódica.
+    with _LOADER_LOCK:
+        if _LOADER["thread"] is not None:
+            return
+        _LOADER["thread"] = threading.Thread(
+            target=watch_data_files, args=(intervalo,), name="recarga-dados", daemon=True
+        )
+
+    try:
+        reload_snapshot()
+    except Exception as e:
+        print(f"Falha na carga inicial dos dados: {e}")
+    _LOADER["thread"].start()
+
+
+def reset_loader_after_fork() -> None:
+    # Worker criado por fork depois da carga (ex.: gunicorn --preload): o
+    # snapshot veio junto, mas a thread de recarga não, e a trava pode ter
+    # sido copiada fechada. A verificação volta na primeira requisição.
+    global _LOADER_LOCK
+    _LOADER_LOCK = threading.Lock()
+    _LOADER["thread"] = None
+
+
+# Não existe no Windows, onde também não há fork.
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=reset_loader_after_fork)
+
+
+def create_app() -> Flask:
+    # Fábrica para servidores WSGI ("app:create_app()"): a carga começa no
+    # processo que chama a fábrica, não na importação do módulo (testes e
+    # ferramentas importam sem ler dados nem criar threads). Com gunicorn,
+    # gunicorn.conf.py inicia a carga em cada worker depois do fork.
+    start_loader()
+    return app
+
+
+def get_snapshot() -> dict:
+    if _LOADER["thread"] is None:
+        start_loader()
+    snap = _LOADER["snapshot"]
+    if snap is None:
+        reload_snapshot()
+        snap = _LOADER["snapshot"]
+        if snap is None:
+            raise RuntimeError(f"Dados indisponíveis: {_LOADER['erro']}")
+    return snap
+
+
 @app.get("/api/health")
 def health():
     return jsonify({"status": "ok"})
 
 
+@app.get("/api/admin/snapshot")
+def status_snapshot():
+    snap = _LOADER["snapshot"]
+    return jsonify({
+        "versao": snap["versao"] if snap else 0,
+        "carregado_em": snap["carregado_em"] if snap else None,
+        "duracao_s": snap["duracao_s"] if snap else None,
+        "origem": snap["origem"] if snap else None,
+        "arquivos": snap["assinatura"] if snap else None,
+        "verificado_em": _LOADER["verificado_em"],
+        "erro": _LOADER["erro"],
+    })
+
+
 @app.get("/api/operadoras")
 def listar_operadoras():
-    op = load_operadoras()
+    op = get_snapshot()["operadoras"]
     rows = op["rows"]
 
     page = int(request.args.get("page", 1))
@@ -151,20 +711,19 @@ def listar_operadoras():
     q = (request.args.get("q") or "").strip().lower()
     q_digits = only_digits(q)
 
-    filtered = rows
+    # Só as posições das linhas encontradas são reunidas; as linhas em si
+    # são copiadas apenas para a página pedida.
+    filtered = range(len(rows))
     if q:
-        def match(r):
-            by_name = q in (r.get("_razao_norm") or "")
-            by_cnpj = q_digits and q_digits in (r.get("_cnpj_norm") or "")
-            by_reg = q_digits and q_digits in (r.get("_registro_norm") or "")
-            return by_name or by_cnpj or by_reg
-
-        filtered = [r for r in rows if match(r)]
+        encontradas = set(search_trigrams(*op["busca_nome"], q))
+        if q_digits:
+            encontradas.update(search_trigrams(*op["busca_digitos"], q_digits))
+        filtered = sorted(encontradas)
 
     total = len(filtered)
     start = (page - 1) * limit
     end = start + limit
-    page_rows = filtered[start:end]
+    page_rows = [rows[i] for i in filtered[start:end]]
 
     data = []
     for r in page_rows:
@@ -179,7 +738,7 @@ def listar_operadoras():
 
 @app.get("/api/operadoras/<cnpj>")
 def detalhe_operadora(cnpj):
-    found = find_operadora(cnpj)
+    found = find_operadora(get_snapshot()["operadoras"], cnpj)
     if not found:
         return jsonify({"error": "Operadora não encontrada"}), 404
 
@@ -192,71 +751,151 @@ def detalhe_operadora(cnpj):
 
 @app.get("/api/operadoras/<cnpj>/despesas")
 def despesas_operadora(cnpj):
-    found = find_operadora(cnpj)
+    # Um único snapshot por requisição, mesmo que outro seja publicado no meio.
+    snap = get_snapshot()
+    found = find_operadora(snap["operadoras"], cnpj)
     if not found:
         return jsonify({"error": "Operadora não encontrada"}), 404
 
     registro = only_digits(found.get("REGISTRO_OPERADORA", ""))
-    desp = load_despesas()
+    desp = snap["despesas"]
+    data = [desp["publicas"][i] for i in desp["historico"].get(registro, ())]
+
+    return jsonify({"cnpj": only_digits(found.get("CNPJ", "")), "registro_ans": registro, "data": data})
 
-    hist = [r for r in desp["rows"] if r.get("_registro_norm") == registro]
-    hist.sort(key=lambda r: (r.get("_ano_num", 0), r.get("_tri_num", 0)))
 
-    data = []
-    for r in hist:
-        rr = dict(r)
-        rr.pop("_registro_norm", None)
-        rr.pop("_valor_num", None)
-        rr.pop("_ano_num", None)
-        rr.pop("_tri_num", None)
-        data.append(rr)
+FILTROS_ESTATISTICAS = ("ano", "trimestre", "uf", "modalidade")
 
-    return jsonify({"cnpj": only_digits(found.get("CNPJ", "")), "registro_ans": registro, "data": data})
 
+def estatisticas_vazias() -> dict:
+    return {
+        "total_despesas": 0.0,
+        "media_despesas": 0.0,
+        "top_5_operadoras": [],
+        "despesas_por_uf": []
+    }
 
-@app.get("/api/estatisticas")
-def estatisticas():
-    op = load_operadoras()
-    desp = load_despesas()
-    rows = desp["rows"]
 
-    if not rows:
-        return jsonify({
-            "total_despesas": 0.0,
-            "media_despesas": 0.0,
-            "top_5_operadoras": [],
-            "despesas_por_uf": []
-        })
+def combine_estatisticas(parciais) -> dict:
+    # Cada nome/UF guarda (centavos, posição da primeira linha): o desempate
+    # pela primeira ocorrência dá a mesma ordem da varredura linha a linha.
+    linhas = 0
+    total = 0
+    nomes = {}
+    ufs = {}
+    for (_, _, uf, _), p in parciais:
+        linhas += p["linhas"]
+        total += p["total"]
+        v, primeiro = ufs.get(uf, (0, p["primeiro"]))
+        ufs[uf] = (v + p["total"], min(primeiro, p["primeiro"]))
+        for nome, (valor, primeira) in p["nomes"].items():
+            v, primeiro = nomes.get(nome, (0, primeira))
+            nomes[nome] = (v + valor, min(primeiro, primeira))
+
+    if not linhas:
+        return estatisticas_vazias()
+
+    ordem = lambda x: (-x[1][0], x[1][1])
+    top5 = heapq.nsmallest(5, nomes.items(), key=ordem)
+    return {
+        "total_despesas": total / 100,
+        "media_despesas": total / linhas / 100,
+        "top_5_operadoras": [{"nome": k, "total": v / 100} for k, (v, _) in top5],
+        "despesas_por_uf": [{"uf": uf, "total": v / 100} for uf, (v, _) in sorted(ufs.items(), key=ordem)]
+    }
 
-    total = sum(r.get("_valor_num", 0.0) for r in rows)
-    media = total / len(rows)
 
-    agg = defaultdict(float)
-    for r in rows:
-        nome = (r.get("RazaoSocial", "") or "").strip()
+def despesas_linhas(desp: dict):
+    # (registro, razão social, centavos, ano, trimestre) de cada linha; no
+    # modo colunar as colunas são lidas inteiras em vez de linha a linha.
+    tabela = desp.get("tabela")
+    if tabela is None:
+        return (
+            (r["_registro_norm"], r.get("RazaoSocial", ""), r["_valor_centavos"], r["_ano_num"], r["_tri_num"])
+            for r in desp["rows"]
+        )
+
+    razoes = tabela.valores("RazaoSocial") if "RazaoSocial" in tabela.colunas else [""] * tabela.n
+    return zip(
+        tabela.valores("_registro_norm"),
+        razoes,
+        tabela.valores("_valor_centavos"),
+        tabela.valores("_ano_num"),
+        tabela.valores("_tri_num"),
+    )
+
+
+def build_estatisticas(op: dict, desp: dict) -> dict:
+    # Agregados parciais por (ano, trimestre, UF, modalidade), calculados uma
+    # vez na carga; a resposta sem filtros já fica pronta.
+    cadastro = {}
+    parciais = {}
+    for pos, (registro, razao, valor, ano, tri) in enumerate(despesas_linhas(desp)):
+        if registro not in cadastro:
+            op_row = op["registro"].por_registro(registro)
+            cadastro[registro] = (
+                (op_row.get("UF") if op_row else None) or "SEM_UF",
+                (op_row.get("Modalidade") if op_row else None) or "SEM_MODALIDADE",
+            )
+        uf, modalidade = cadastro[registro]
+
+        chave = (ano, tri, uf, modalidade)
+        p = parciais.get(chave)
+        if p is None:
+            p = parciais[chave] = {"linhas": 0, "total": 0, "primeiro": pos, "nomes": {}}
+
+        nome = (razao or "").strip()
         if not nome:
-            nome = r.get("_registro_norm", "") or "SEM_NOME"
-        agg[nome] += r.get("_valor_num", 0.0)
+            nome = registro or "SEM_NOME"
+        p["linhas"] += 1
+        p["total"] += valor
+        v, primeiro = p["nomes"].get(nome, (0, pos))
+        p["nomes"][nome] = (v + valor, primeiro)
 
-    top5 = sorted(agg.items(), key=lambda x: x[1], reverse=True)[:5]
-    top5_list = [{"nome": k, "total": v} for k, v in top5]
+    parciais = tuple(parciais.items())
+    return {"parciais": parciais, "geral": combine_estatisticas(parciais)}
 
-    uf_totais = defaultdict(float)
-    for r in rows:
-        registro = r.get("_registro_norm", "")
-        op_row = op["by_registro"].get(registro)
-        uf = (op_row.get("UF") if op_row else None) or "SEM_UF"
-        uf_totais[uf] += r.get("_valor_num", 0.0)
 
-    despesas_por_uf = [{"uf": uf, "total": val} for uf, val in sorted(uf_totais.items(), key=lambda x: x[1], reverse=True)]
+@app.get("/api/estatisticas")
+def estatisticas():
+    est = get_snapshot()["estatisticas"]
+
+    filtros = {k: request.args.get(k, "").strip() for k in FILTROS_ESTATISTICAS}
+    if not any(filtros.values()):
+        return jsonify(est["geral"])
 
-    return jsonify({
-        "total_despesas": total,
-        "media_despesas": media,
-        "top_5_operadoras": top5_list,
-        "despesas_por_uf": despesas_por_uf
-    })
+    ano = to_int_digits(filtros["ano"]) if filtros["ano"] else None
+    tri = to_int_digits(filtros["trimestre"]) if filtros["trimestre"] else None
+    uf = filtros["uf"].upper() or None
+    modalidade = filtros["modalidade"].lower() or None
+
+    selecionados = [
+        (chave, p) for chave, p in est["parciais"]
+        if (ano is None or chave[0] == ano)
+        and (tri is None or chave[1] == tri)
+        and (uf is None or chave[2].upper() == uf)
+        and (modalidade is None or chave[3].lower() == modalidade)
+    ]
+    return jsonify(combine_estatisticas(selecionados))
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="API das operadoras")
+    parser.add_argument(
+        "--gerar-fast-start",
+        action="store_true",
+        help=f"só lê os CSVs e grava {FAST_START_PATH.name} (ou os arquivos colunares), sem subir o servidor",
+    )
+    args = parser.parse_args()
+
+    if args.gerar_fast_start:
+        load_sources(source_hashes())
+        print(f"Dados preparados para o modo {ARMAZENAMENTO}")
+        sys.exit(0)
+
+    # Com debug=True o Flask sobe um processo observador e um filho que atende
+    # as requisições; só o filho carrega os dados (o observador não atende
+    # nada).
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_loader()
     app.run(host="0.0.0.0", port=5000, debug=True)
@@ -0,0 +1,13 @@
+# gunicorn -c gunicorn.conf.py
+#
+# A carga dos dados começa em cada worker logo depois do fork, e não na
+# importação do módulo: com --preload o master importa o app, mas não lê os
+# CSVs nem cria a thread de recarga.
+wsgi_app = "app:app"
+bind = "0.0.0.0:5000"
+
+
+def post_fork(server, worker):
+    from app import start_loader
+
+    start_loader()
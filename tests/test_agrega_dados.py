@@ -0,0 +1,37 @@
+import random
+
+import pytest
+
+from ans_dados import agrega_dados
+
+np = pytest.importorskip("numpy")
+
+
+def valores_aleatorios(semente: int, n: int = 3000):
+    rnd = random.Random(semente)
+    grupos = [(f"OPERADORA {i}", rnd.choice(["SP", "RJ", "MG", ""])) for i in range(150)]
+    tris = [f"{ano}-{tri}" for ano in (2022, 2023, 2024) for tri in ("1T", "2T", "3T", "4T")]
+    valores = []
+    for _ in range(n):
+        # Magnitudes bem diferentes para exercitar a soma compensada.
+        escala = 10 ** rnd.randint(0, 13)
+        valores.append((rnd.choice(grupos), rnd.choice(tris), rnd.randint(-escala, escala)))
+    return valores
+
+
+@pytest.mark.parametrize("semente", range(5))
+def test_soma_colunas_igual_ao_sum(semente):
+    rnd = random.Random(semente)
+    m = np.array([[rnd.uniform(-1, 1) * 10 ** rnd.randint(-8, 16) for _ in range(12)] for _ in range(200)])
+    presente = np.array([[rnd.random() < 0.7 for _ in range(12)] for _ in range(200)])
+    esperado = [sum(x for x, p in zip(linha, pres) if p) for linha, pres in zip(m.tolist(), presente.tolist())]
+    assert agrega_dados.soma_colunas(m, presente).tolist() == esperado
+
+
+@pytest.mark.parametrize("semente", range(5))
+def test_numpy_python_e_spill_iguais(semente, tmp_path):
+    valores = valores_aleatorios(semente)
+    esperado = agrega_dados.agregar_python(valores)
+    assert agrega_dados.agregar_numpy(valores) == esperado
+    # Limite minúsculo força o caminho com partições em disco.
+    assert list(agrega_dados.agregar_limitado(valores, 0.001, tmp_path)) == esperado
@@ -0,0 +1,195 @@
+import gzip
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from ans_dados import ans_source
+
+CONTEUDO = bytes(range(256)) * 400
+
+
+class Servidor(BaseHTTPRequestHandler):
+    # Arquivos em `rotas` (caminho -> bytes); `modo` muda como o Range é
+    # respondido, para simular servidores que não se comportam.
+    rotas: dict = {}
+    modo = "normal"
+    pedidos: list = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.pedidos.append((self.path, dict(self.headers)))
+        corpo = self.rotas.get(self.path)
+        if corpo is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        # Listagens de diretório: HTML com ETag e revalidação por If-None-Match.
+        if isinstance(corpo, str):
+            etag = f'"{abs(hash(corpo))}"'
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.end_headers()
+                return
+            dados = corpo.encode("utf-8")
+            self.send_response(200)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(dados)))
+            self.end_headers()
+            self.wfile.write(dados)
+            return
+
+        faixa = self.headers.get("Range")
+        if faixa and self.modo != "ignora_range":
+            inicio = int(faixa.removeprefix("bytes=").rstrip("-"))
+            if self.modo == "faixa_errada":
+                inicio = 0
+            parte = corpo[inicio:]
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {inicio}-{len(corpo) - 1}/{len(corpo)}")
+            self.send_header("Content-Length", str(len(parte)))
+            self.send_header("ETag", '"v1"')
+            self.end_headers()
+            self.wfile.write(parte)
+            return
+
+        self.send_response(200)
+        self.send_header("ETag", '"v1"')
+        if self.modo == "gzip":
+            corpo = gzip.compress(corpo)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+
+@pytest.fixture
+def servidor():
+    Servidor.rotas = {}
+    Servidor.modo = "normal"
+    Servidor.pedidos = []
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Servidor)
+    t = threading.Thread(target=httpd.serve_forever, daemon=True)
+    t.start()
+    yield Servidor, f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def preparar_parcial(path, tamanho: int) -> None:
+    path.with_name(path.name + ".part").write_bytes(CONTEUDO[:tamanho])
+    ans_source.gravar_json(path.with_name(path.name + ".part.json"), {"etag": '"v1"'})
+
+
+@pytest.mark.parametrize("modo", ["normal", "faixa_errada", "ignora_range"])
+def test_retomada_nunca_corrompe(servidor, tmp_path, modo):
+    srv, base = servidor
+    srv.rotas = {"/1T2024.zip": CONTEUDO}
+    srv.modo = modo
+    destino = tmp_path / "1T2024.zip"
+    preparar_parcial(destino, 1000)
+
+    with ans_source.criar_sessao(1) as sessao:
+        meta = ans_source.baixar_zip(sessao, f"{base}/1T2024.zip", destino, None)
+
+    assert destino.read_bytes() == CONTEUDO
+    assert meta["tamanho"] == len(CONTEUDO)
+    assert srv.pedidos[0][1]["Range"] == "bytes=1000-"
+
+
+def test_content_encoding_confere_bytes_da_rede(servidor, tmp_path):
+    srv, base = servidor
+    srv.rotas = {"/1T2024.zip": CONTEUDO}
+    srv.modo = "gzip"
+    destino = tmp_path / "1T2024.zip"
+
+    with ans_source.criar_sessao(1) as sessao:
+        ans_source.baixar_zip(sessao, f"{base}/1T2024.zip", destino, None)
+
+    assert destino.read_bytes() == CONTEUDO
+    assert srv.pedidos[0][1]["Accept-Encoding"] == "identity"
+    # Sem retomada de um .part decodificado.
+    assert not destino.with_name(destino.name + ".part.json").exists()
+
+
+def listagem(*nomes: str) -> str:
+    return "".join(f'<a href="{n}">{n}</a>' for n in nomes)
+
+
+def rotas_anos(trimestres: dict[int, list[int]]) -> dict:
+    rotas = {"/": listagem("../", *(f"{ano}/" for ano in trimestres))}
+    for ano, tris in trimestres.items():
+        rotas[f"/{ano}/"] = listagem(*(f"{t}T{ano}.zip" for t in tris))
+    return rotas
+
+
+def caminhos(srv) -> list[str]:
+    return [p for p, _ in srv.pedidos]
+
+
+def test_cache_de_listagens_ttl_e_revalidacao(servidor, tmp_path):
+    srv, base = servidor
+    srv.rotas = rotas_anos({2024: [1, 2, 3], 2023: [1, 2, 3, 4]})
+    cache = tmp_path / "listagens.json"
+
+    urls = ans_source.get_latest_zip_urls(base + "/", n=3, jobs=1, cache_path=cache, ttl=3600)
+    assert urls == [f"{base}/2024/{t}T2024.zip" for t in (3, 2, 1)]
+    assert caminhos(srv) == ["/", "/2024/"]
+
+    # Dentro do TTL: nenhuma requisição.
+    srv.pedidos.clear()
+    assert ans_source.get_latest_zip_urls(base + "/", n=3, jobs=1, cache_path=cache, ttl=3600) == urls
+    assert srv.pedidos == []
+
+    # TTL vencido: revalida com If-None-Match, recebe 304 e mantém os links.
+    antes = ans_source.ler_json(cache)
+    srv.pedidos.clear()
+    assert ans_source.get_latest_zip_urls(base + "/", n=3, jobs=1, cache_path=cache, ttl=0) == urls
+    assert caminhos(srv) == ["/", "/2024/"]
+    assert all(h.get("If-None-Match") for _, h in srv.pedidos)
+    depois = ans_source.ler_json(cache)
+    assert depois[base + "/"]["links"] == antes[base + "/"]["links"]
+    assert depois[base + "/"]["obtido_em"] > antes[base + "/"]["obtido_em"]
+
+
+def test_listagem_alterada_apos_ttl_e_relida(servidor, tmp_path):
+    srv, base = servidor
+    srv.rotas = rotas_anos({2024: [1, 2, 3], 2023: [1, 2, 3, 4]})
+    cache = tmp_path / "listagens.json"
+    ans_source.get_latest_zip_urls(base + "/", n=3, jobs=1, cache_path=cache, ttl=3600)
+
+    srv.rotas = rotas_anos({2024: [1, 2, 3, 4], 2023: [1, 2, 3, 4]})
+    assert ans_source.get_latest_zip_urls(base + "/", n=1, jobs=1, cache_path=cache, ttl=3600) == [
+        f"{base}/2024/3T2024.zip"
+    ]
+    assert ans_source.get_latest_zip_urls(base + "/", n=1, jobs=1, cache_path=cache, ttl=0) == [
+        f"{base}/2024/4T2024.zip"
+    ]
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_parada_antecipada_por_ano(servidor, tmp_path, jobs):
+    srv, base = servidor
+    srv.rotas = rotas_anos({2024: [1], 2023: [2, 3, 4], 2022: [1, 2, 3, 4], 2021: [1, 2, 3, 4], 2020: [4]})
+
+    urls = ans_source.get_latest_zip_urls(base + "/", n=3, jobs=jobs, cache_path=None)
+
+    assert urls == [f"{base}/2024/1T2024.zip", f"{base}/2023/4T2023.zip", f"{base}/2023/3T2023.zip"]
+    # 2024 sozinho não completa 3 trimestres; depois de 2023 nenhum ano mais
+    # antigo pode entrar, então 2022, 2021 e 2020 nunca são listados.
+    lidos = set(caminhos(srv))
+    assert {"/2024/", "/2023/"} <= lidos
+    assert not lidos & {"/2022/", "/2021/", "/2020/"}
+
+
+def test_parada_antecipada_nao_perde_ano_com_trimestres_faltando(servidor, tmp_path):
+    srv, base = servidor
+    srv.rotas = rotas_anos({2024: [], 2023: [4], 2022: [3, 4]})
+
+    urls = ans_source.get_latest_zip_urls(base + "/", n=3, jobs=1, cache_path=None)
+
+    assert urls == [f"{base}/2023/4T2023.zip", f"{base}/2022/4T2022.zip", f"{base}/2022/3T2022.zip"]
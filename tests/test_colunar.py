@@ -0,0 +1,36 @@
+import pytest
+
+from ans_dados.colunar import ESQUEMA_DESPESAS, SUFIXO, TabelaColunar, abrir_escrita, abrir_leitura
+from ans_dados.numeros import Centavos, parse_centavos
+
+CAMPOS = ["RegistroANS", "Ano", "ValorDespesas"]
+# 90 trilhões de reais com centavos: acima de 2**53 centavos, onde o float64
+# já não representa todos os valores.
+VALORES = ["90071992547409.93", "0.01", "-1234.56", "", "abc"]
+
+
+@pytest.mark.parametrize("sufixo", [SUFIXO, ".csv"])
+def test_valor_despesas_em_centavos_sem_perda(tmp_path, sufixo):
+    entrada = tmp_path / f"entrada{SUFIXO}"
+    with abrir_escrita(entrada, CAMPOS, ESQUEMA_DESPESAS) as w:
+        for i, v in enumerate(VALORES):
+            w.writerow({"RegistroANS": str(i), "Ano": "2024", "ValorDespesas": v})
+
+    with TabelaColunar(entrada) as t:
+        assert t.colunas["ValorDespesas"]["tipo"] == "centavos"
+        assert t.coluna("ValorDespesas")[0] == 9007199254740993
+        assert t.valor("ValorDespesas", 2) == -123456
+        assert t.valor("ValorDespesas", 3) is None
+
+    # Passa por outra etapa (como enriquecimento e validação) e sai em texto.
+    saida = tmp_path / f"saida{sufixo}"
+    with abrir_leitura(entrada) as (campos, linhas), abrir_escrita(saida, campos, ESQUEMA_DESPESAS) as w:
+        for row in linhas:
+            assert row["ValorDespesas"] is None or isinstance(row["ValorDespesas"], Centavos)
+            w.writerow(row)
+
+    with abrir_leitura(saida) as (_, linhas):
+        valores = [row["ValorDespesas"] for row in linhas]
+    assert [parse_centavos(v) for v in valores] == [9007199254740993, 1, -123456, None, None]
+    if sufixo == ".csv":
+        assert valores == ["90071992547409.93", "0.01", "-1234.56", "", ""]
@@ -0,0 +1,39 @@
+import io
+import zipfile
+
+import pytest
+
+from ans_dados import leitor_xlsx
+from ans_dados.leitor_xlsx import LeitorXlsx, PlanilhaNaoSuportada
+
+
+def xlsx(arquivos: dict[str, str]) -> io.BytesIO:
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as z:
+        for nome, conteudo in arquivos.items():
+            z.writestr(nome, conteudo)
+    buf.seek(0)
+    return buf
+
+
+@pytest.mark.parametrize("arquivos", [
+    {"[Content_Types].xml": "<Types/>"},
+    {"xl/workbook.xml": '<workbook xmlns="http://purl.oclc.org/ooxml/spreadsheetml/main"/>'},
+])
+def test_planilha_nao_suportada_fecha_o_zip(monkeypatch, arquivos):
+    fonte = xlsx(arquivos)
+    abertos = []
+
+    class ZipRegistrado(zipfile.ZipFile):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            abertos.append(self)
+
+    monkeypatch.setattr(leitor_xlsx.zipfile, "ZipFile", ZipRegistrado)
+
+    with pytest.raises(PlanilhaNaoSuportada):
+        LeitorXlsx(fonte)
+
+    assert len(abertos) == 1 and abertos[0].fp is None
+    # O BytesIO continua utilizável para o fallback do openpyxl.
+    assert not fonte.closed
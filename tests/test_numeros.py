@@ -0,0 +1,45 @@
+import pytest
+
+from ans_dados.numeros import formatar_centavos, parse_centavos
+
+
+@pytest.mark.parametrize("texto, centavos", [
+    ("1234,56", 123456),
+    ("-1234,56", -123456),
+    ("1234.56", 123456),
+    ("1.234,56", 123456),
+    ("1,234.56", 123456),
+    ("1.234.567", 123456700),
+    ("150,000", 15000),
+    ("0,125", 13),
+    ("-0,125", -13),
+    ("1e3", 100000),
+    ("", None),
+    ("abc", None),
+])
+def test_parse_centavos(texto, centavos):
+    assert parse_centavos(texto) == centavos
+    assert parse_centavos(texto, ponto_milhar=True) == centavos
+
+
+@pytest.mark.parametrize("texto, decimal, milhar", [
+    ("150.000", 15000, 15000000),
+    ("-150.000", -15000, -15000000),
+    ("0.123", 12, 12300),
+    ("1.5", 150, 150),
+    ("150.0000", 15000, 15000),
+])
+def test_ponto_unico_depende_da_origem(texto, decimal, milhar):
+    # CSVs do pipeline usam "." decimal; nos arquivos da ANS, "150.000" é milhar.
+    assert parse_centavos(texto) == decimal
+    assert parse_centavos(texto, ponto_milhar=True) == milhar
+
+
+@pytest.mark.parametrize("texto", ["12,²3", "12,٣٤", "12²,34", "١٢٣,٤٥", "-١,٢٣"])
+def test_digitos_nao_ascii_sao_rejeitados(texto):
+    assert parse_centavos(texto) is None
+
+
+def test_formatar_centavos_volta_ao_mesmo_valor():
+    for c in (0, 5, -5, 123456, -123456, 10**15 + 1):
+        assert parse_centavos(formatar_centavos(c)) == c
@@ -0,0 +1,48 @@
+import zipfile
+
+import pytest
+
+from ans_dados import processa_dados
+
+
+def gerar_csv(n: int = 400) -> bytes:
+    linhas = ["REG_ANS;DESCRICAO;VL_SALDO_FINAL"]
+    for i in range(n):
+        if i == 37:
+            # Aspa solta no meio do campo: o csv a trata como caractere comum.
+            linhas.append(f'{i};EVENTOS 5" INDENIZAVEIS;{i},50')
+        elif i == 211:
+            linhas.append(f'{i};"SINISTROS\nEM DUAS LINHAS";{i},00')
+        elif i % 3:
+            linhas.append(f"{i};EVENTOS CONHECIDOS {i};{i},10")
+        else:
+            linhas.append(f"{i};RECEITAS {i};{i},20")
+    return ("\n".join(linhas) + "\n").encode("utf-8")
+
+
+@pytest.mark.parametrize("bloco", [processa_dados.BLOCO_FILTRO, 256])
+def test_pre_filtro_com_aspa_desbalanceada(monkeypatch, tmp_path, bloco):
+    monkeypatch.setattr(processa_dados, "BLOCO_FILTRO", bloco)
+    arquivo = tmp_path / "1T2024.csv"
+    arquivo.write_bytes(gerar_csv())
+
+    esperado = list(processa_dados.filtrar_fonte(arquivo))
+    assert len(esperado) > 200
+    assert list(processa_dados.filtrar_fonte(arquivo, pre_filtro=True)) == esperado
+
+    trechos = processa_dados.dividir_fonte(arquivo, 2048)
+    assert len(trechos) >= 2
+    for trecho in trechos:
+        assert list(processa_dados.filtrar_fonte(arquivo, trecho, pre_filtro=True)) == list(
+            processa_dados.filtrar_fonte(arquivo, trecho)
+        )
+
+
+def test_pre_filtro_com_aspa_desbalanceada_em_zip(tmp_path):
+    caminho = tmp_path / "1T2024.zip"
+    with zipfile.ZipFile(caminho, "w") as z:
+        z.writestr("1T2024.csv", gerar_csv())
+
+    fonte = (caminho, "1T2024.csv")
+    esperado = list(processa_dados.filtrar_fonte(fonte))
+    assert list(processa_dados.filtrar_fonte(fonte, pre_filtro=True)) == esperado
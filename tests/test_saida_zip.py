@@ -0,0 +1,30 @@
+import zipfile
+
+import pytest
+
+from ans_dados.saida_zip import csv_para_zip
+
+
+def test_csv_para_zip_grava_entrada_e_copia(tmp_path):
+    destino = tmp_path / "saida.zip"
+    copia = tmp_path / "saida.csv"
+    with csv_para_zip(destino, "saida.csv", copia=copia) as f:
+        f.write("a;b\r\n1;2\r\n")
+
+    with zipfile.ZipFile(destino) as z:
+        assert z.read("saida.csv") == b"a;b\r\n1;2\r\n"
+    assert copia.read_bytes() == b"a;b\r\n1;2\r\n"
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["saida.csv", "saida.zip"]
+
+
+def test_csv_para_zip_remove_temporario_em_erro(tmp_path):
+    destino = tmp_path / "saida.zip"
+    destino.write_bytes(b"anterior")
+
+    with pytest.raises(RuntimeError):
+        with csv_para_zip(destino, "saida.csv") as f:
+            f.write("a;b\r\n")
+            raise RuntimeError("falha no meio da escrita")
+
+    assert destino.read_bytes() == b"anterior"
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["saida.zip"]